@@ -0,0 +1,371 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from stage_timer import NULL_TIMER, StageTimer
+
+# Headless benchmark for the vision scripts.
+#
+# Drives risk_speed.process_frame, the lane_car / obs_lane frame steps and
+# the speed_final estimator over a video file, or over a
+# generated synthetic road video, without opening any window. Reports
+# throughput and p50/p95/p99 latency per stage as JSON, and can compare the
+# run against a stored baseline to catch regressions before a build is
+# flashed to the bikes.
+#
+#   python benchmark.py risk_speed --synthetic-frames 300 --output run.json
+#   python benchmark.py all --video ride.mp4 --baseline baseline.json
+
+TARGETS = ('risk_speed', 'lane_car', 'obs_lane', 'speed_final')
+
+DEFAULT_WEIGHTS = {
+    'risk_speed': 'yolov8n.pt',
+    'lane_car': 'weights/yolov8n.pt',
+    'obs_lane': 'yolov8n.pt',
+    'speed_final': 'models/vehicle.pt'
+}
+
+
+def make_synthetic_video(path, num_frames=300, size=(640, 480), fps=30,
+                         num_vehicles=4, seed=0):
+    # Road with white and yellow lane markings, moving dashes and textured
+    # "vehicles" drifting and growing, so lane detection and optical flow
+    # both have real work to do
+    rng = np.random.default_rng(seed)
+    width, height = size
+    horizon = int(height * 0.5)
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not open video writer for {path}")
+
+    textures = [
+        rng.integers(0, 255, (64, 64, 3), dtype=np.uint8) for _ in range(num_vehicles)
+    ]
+    starts = rng.uniform([0.1 * width, horizon + 20], [0.8 * width, height - 120],
+                         size=(num_vehicles, 2))
+    velocities = rng.uniform([-2.0, 0.2], [2.0, 1.5], size=(num_vehicles, 2))
+    sizes = rng.uniform(40, 90, size=num_vehicles)
+
+    road = np.array([
+        [0, height], [int(width * 0.4), horizon],
+        [int(width * 0.6), horizon], [width, height]
+    ], dtype=np.int32)
+
+    for i in range(num_frames):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:horizon] = (200, 180, 150)
+        frame[horizon:] = (60, 90, 70)
+        cv2.fillPoly(frame, [road], (80, 80, 80))
+
+        cv2.line(frame, (int(width * 0.1), height), (int(width * 0.44), horizon + 10),
+                 (255, 255, 255), 6)
+        cv2.line(frame, (int(width * 0.9), height), (int(width * 0.56), horizon + 10),
+                 (0, 220, 230), 6)
+
+        # Dashed centre line scrolling towards the camera
+        for k in range(8):
+            t = ((k / 8.0) + i * 0.01) % 1.0
+            y_a = int(horizon + t * (height - horizon))
+            y_b = int(min(height, y_a + 8 + 30 * t))
+            cv2.line(frame, (width // 2, y_a), (width // 2, y_b), (255, 255, 255), 2 + int(4 * t))
+
+        for v in range(num_vehicles):
+            cx, cy = starts[v] + velocities[v] * i
+            cx = cx % width
+            cy = horizon + 20 + (cy - horizon - 20) % (height - horizon - 60)
+            side = int(sizes[v] * (0.6 + 0.8 * (cy - horizon) / (height - horizon)))
+            x1, y1 = int(cx - side / 2), int(cy - side / 2)
+            x2, y2 = min(width, x1 + side), min(height, y1 + side)
+            x1, y1 = max(0, x1), max(0, y1)
+            if x2 - x1 > 2 and y2 - y1 > 2:
+                frame[y1:y2, x1:x2] = cv2.resize(textures[v], (x2 - x1, y2 - y1))
+
+        writer.write(frame)
+
+    writer.release()
+    return path
+
+
+class _EmptyResult:
+    boxes = ()
+
+
+class NullDetector:
+    # Stand-in for a YOLO model when only the non-detection stages matter
+    names = {}
+
+    def __call__(self, frame, **kwargs):
+        return [_EmptyResult()]
+
+
+def load_detector(kind, weights, backend='torch', int8=False):
+    if kind == 'none':
+        return NullDetector()
+    from inference_service import get_service
+    return get_service(backend=backend, int8=int8).client(weights)
+
+
+def read_frames(cap, timer, warmup, max_frames=None):
+    index = 0
+    while max_frames is None or index < max_frames:
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index >= warmup:
+            timer.record('decode', time.perf_counter() - start)
+        yield index, frame
+        index += 1
+
+
+def make_step(target, model, fps, keyframe=False, render=True):
+    # Returns step(frame, timer) running one frame of the target's per-frame
+    # work, split into the same stages the script itself runs. Without
+    # `render` the drawing stages are skipped, as in headless telemetry mode.
+    if target == 'risk_speed':
+        import risk_speed
+        from tracker import MultiObjectTracker
+        lane_detector = risk_speed.LaneDetector()
+        tracker = MultiObjectTracker()
+        acc_detector = risk_speed.accDetector(fps=fps)
+        risk_assessor = risk_speed.RiskAssessor()
+        if keyframe:
+            model = risk_speed.make_keyframe_detector(model, budget_ms=1000.0 / fps)
+
+        def step(frame, timer):
+            risk_speed.process_frame(
+                frame, model, lane_detector, tracker, acc_detector,
+                risk_assessor, time.time(), timer, render
+            )
+        return step
+
+    if target in ('lane_car', 'obs_lane'):
+        from detection_planner import DetectionInputPlanner
+        from lane_tracker import LaneTracker
+        module = __import__(target)
+        planner = DetectionInputPlanner()
+        lane_tracker = LaneTracker()
+
+        def step(frame, timer):
+            # As in the scripts: pooled resize, lanes, detection, then the
+            # lane is drawn onto the resized frame itself
+            with timer('resize'):
+                resized_frame = module.frame_pool.resize(frame, (1280, 720), name='resized')
+            with timer('lane'):
+                lane_lines = lane_tracker.update(resized_frame).lines
+            roi_vertices = LaneTracker.roi_vertices(1280, 720)
+            with timer('detect'):
+                planner.detect(model, resized_frame, roi_vertices)
+            if render and lane_lines is not None:
+                with timer('render'):
+                    module.draw_lane_lines(resized_frame, *lane_lines)
+        return step
+
+    if target == 'speed_final':
+        import speed_final
+        estimator = speed_final.SpeedEstimator(fps)
+
+        def step(frame, timer):
+            if estimator.prev_gray is None:
+                estimator.start(frame)
+                return
+            with timer('detect'):
+                boxes = speed_final.detect_boxes(model, frame)
+            with timer('track'):
+                ids = estimator.assign_ids(boxes)
+            with timer('flow'):
+                estimates = estimator.estimate_speeds(frame, boxes, ids, keep_flow=render)
+            if render:
+                with timer('render'):
+                    speed_final.render_estimates(frame, estimates)
+        return step
+
+    raise ValueError(f"Unknown benchmark target: {target}")
+
+
+def run_benchmark(target, source, model, warmup=10, max_frames=None, keyframe=False,
+                  render=True):
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video source {source}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+
+    timer = StageTimer()
+    step = make_step(target, model, fps, keyframe, render)
+    frames = 0
+    start = None
+
+    try:
+        for index, frame in read_frames(cap, timer, warmup, max_frames):
+            if index == warmup:
+                start = time.perf_counter()
+            step(frame, timer if index >= warmup else NULL_TIMER)
+            if index >= warmup:
+                frames += 1
+    finally:
+        cap.release()
+
+    wall_time = time.perf_counter() - start if start is not None else 0.0
+    return {
+        "target": target,
+        "source": source,
+        "frames": frames,
+        "warmup_frames": warmup,
+        "wall_time_s": wall_time,
+        "throughput_fps": frames / wall_time if wall_time > 0 else 0.0,
+        "stages": timer.summary()
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.1, metric='p95_ms'):
+    # A stage regresses when its latency metric grows by more than
+    # `tolerance`; a run regresses when its throughput drops by more than it
+    regressions = []
+    baseline_runs = {run['target']: run for run in baseline.get('runs', [])}
+
+    for run in report['runs']:
+        base = baseline_runs.get(run['target'])
+        if base is None:
+            continue
+
+        if base['throughput_fps'] > 0:
+            change = run['throughput_fps'] / base['throughput_fps'] - 1.0
+            if change < -tolerance:
+                regressions.append({
+                    "target": run['target'],
+                    "stage": None,
+                    "metric": "throughput_fps",
+                    "baseline": base['throughput_fps'],
+                    "current": run['throughput_fps'],
+                    "change": change
+                })
+
+        for stage, stats in run['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if not base_stats or base_stats[metric] <= 0:
+                continue
+            change = stats[metric] / base_stats[metric] - 1.0
+            if change > tolerance:
+                regressions.append({
+                    "target": run['target'],
+                    "stage": stage,
+                    "metric": metric,
+                    "baseline": base_stats[metric],
+                    "current": stats[metric],
+                    "change": change
+                })
+
+    return regressions
+
+
+def print_report(report):
+    for run in report['runs']:
+        print(f"{run['target']}: {run['frames']} frames, "
+              f"{run['throughput_fps']:.1f} FPS")
+        for stage, stats in run['stages'].items():
+            print(f"  {stage:<8} p50 {stats['p50_ms']:7.2f} ms  "
+                  f"p95 {stats['p95_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark for the vision scripts")
+    parser.add_argument('targets', nargs='+', choices=TARGETS + ('all',))
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--video', help="Video file to benchmark on")
+    source.add_argument('--synthetic-frames', type=int, default=300,
+                        help="Length of the generated road video when --video is not given")
+    parser.add_argument('--synthetic-size', type=int, nargs=2, default=(640, 480),
+                        metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--detector', choices=('yolo', 'none'), default='yolo',
+                        help="'none' skips YOLO to benchmark the other stages alone")
+    parser.add_argument('--weights', help="Override the target's default YOLO weights")
+    parser.add_argument('--backend', choices=('torch', 'onnx', 'torchscript'), default='torch',
+                        help="Inference backend for the YOLO detector")
+    parser.add_argument('--int8', action='store_true', help="INT8-quantize the onnx backend")
+    parser.add_argument('--keyframe', action='store_true',
+                        help="Run risk_speed in adaptive keyframe detection mode")
+    parser.add_argument('--headless', action='store_true',
+                        help="Skip the rendering stages, as in headless telemetry mode")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed frames at the start")
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--output', help="Write the JSON report here")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="Allowed relative slowdown before a stage counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    targets = TARGETS if 'all' in args.targets else tuple(dict.fromkeys(args.targets))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = args.video
+        if source is None:
+            source = make_synthetic_video(
+                os.path.join(tmp_dir, 'synthetic_road.mp4'),
+                num_frames=args.synthetic_frames,
+                size=tuple(args.synthetic_size)
+            )
+
+        runs = []
+        for target in targets:
+            model = load_detector(args.detector, args.weights or DEFAULT_WEIGHTS[target],
+                                  args.backend, args.int8)
+            runs.append(run_benchmark(
+                target, source, model, args.warmup, args.max_frames, args.keyframe,
+                not args.headless
+            ))
+
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "source": args.video or f"synthetic:{args.synthetic_frames}",
+        "detector": args.detector,
+        "backend": args.backend + ("-int8" if args.int8 else ""),
+        "keyframe": args.keyframe,
+        "headless": args.headless,
+        "environment": environment(),
+        "runs": runs
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for r in regressions:
+            where = f"{r['target']}/{r['stage']}" if r['stage'] else r['target']
+            print(f"REGRESSION {where} {r['metric']}: "
+                  f"{r['baseline']:.2f} -> {r['current']:.2f} ({r['change']:+.0%})")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Pre-event "black box" storage for the accident recorder.
+#
+# Raw BGR frames are far too big to keep 30 seconds of them next to the
+# detection models (about 830 MB at 640x480), so the recorder keeps JPEG
+# frames instead. The capture thread hands frames to a FrameEncoder, which
+# encodes them on its own thread and appends them to an EncodedFrameBuffer.
+# The buffer is bounded by a byte budget rather than a frame count: the
+# oldest frames are dropped once the encoded frames exceed it. The same
+# encoded frames can be handed to a live viewer (see live_stream.py).
+
+
+def measured_fps(frames, default=30.0):
+    # Frame rate of timestamped frames from the median frame interval, which
+    # ignores the odd dropped or late frame
+    if len(frames) < 2:
+        return default
+    intervals = np.diff([frame.timestamp for frame in frames])
+    intervals = intervals[intervals > 0]
+    if len(intervals) == 0:
+        return default
+    return float(1.0 / np.median(intervals))
+
+
+class EncodedFrame:
+    __slots__ = ("timestamp", "data", "raw_bytes")
+
+    def __init__(self, timestamp, data, raw_bytes):
+        self.timestamp = timestamp
+        self.data = data  # JPEG bytes
+        self.raw_bytes = raw_bytes
+
+    def decode(self):
+        return cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class EncodedFrameBuffer:
+    def __init__(self, byte_budget=48 * 1024 * 1024):
+        self.byte_budget = byte_budget
+        self._frames = deque()
+        self._bytes = 0
+        self._raw_bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+    def append(self, frame):
+        with self._lock:
+            self._frames.append(frame)
+            self._bytes += len(frame.data)
+            self._raw_bytes += frame.raw_bytes
+            # Always keep the newest frame, even if it alone is over budget
+            while self._bytes > self.byte_budget and len(self._frames) > 1:
+                old = self._frames.popleft()
+                self._bytes -= len(old.data)
+                self._raw_bytes -= old.raw_bytes
+                self.evicted += 1
+
+    def snapshot(self, since=None):
+        # The buffered frames, oldest first, optionally only those captured
+        # after `since`; the list is a copy, the encoded frames themselves are
+        # immutable and shared
+        with self._lock:
+            if since is None:
+                return list(self._frames)
+            return [frame for frame in self._frames if frame.timestamp > since]
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._bytes = self._raw_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            frames = len(self._frames)
+            span = self._frames[-1].timestamp - self._frames[0].timestamp if frames > 1 else 0.0
+            return {
+                "frames": frames,
+                "bytes": self._bytes,
+                "byte_budget": self.byte_budget,
+                "seconds": round(span, 2),
+                "fps": round((frames - 1) / span, 1) if span > 0 else None,
+                "compression_ratio": round(self._raw_bytes / self._bytes, 1) if self._bytes else None,
+                "evicted": self.evicted
+            }
+
+
+class FrameEncoder:
+    # JPEG-encodes frames off the capture thread. submit() never blocks: when
+    # the encoder falls behind, the oldest pending frame is dropped. publish,
+    # if given, is also called with every EncodedFrame.
+    def __init__(self, buffer, quality=80, queue_size=8, publish=None):
+        self.buffer = buffer
+        self.publish = publish
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self._pending = queue.Queue(maxsize=queue_size)
+        self.encoded = 0
+        self.dropped = 0
+        self.encode_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="frame-encoder", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, timestamp=None):
+        item = (frame, time.time() if timestamp is None else timestamp)
+        while True:
+            try:
+                self._pending.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._pending.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            frame, timestamp = item
+            start = time.perf_counter()
+            ok, data = cv2.imencode('.jpg', frame, self.params)
+            self.encode_seconds += time.perf_counter() - start
+            if ok:
+                encoded = EncodedFrame(timestamp, data.tobytes(), frame.nbytes)
+                self.buffer.append(encoded)
+                if self.publish is not None:
+                    self.publish(encoded)
+                self.encoded += 1
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join(timeout=2.0)
+
+    def stats(self):
+        return {
+            "encoded": self.encoded,
+            "dropped": self.dropped,
+            "pending": self._pending.qsize(),
+            "encode_ms": round(1000.0 * self.encode_seconds / self.encoded, 2) if self.encoded else None
+        }
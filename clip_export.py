@@ -0,0 +1,215 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+
+from blackbox import measured_fps
+
+# Background export of accident clips.
+#
+# The /accident request only snapshots the pre-event buffer (a list of
+# references to encoded frames, so it costs microseconds) and queues an
+# export job; decoding and cv2.VideoWriter encoding run on a small worker
+# pool. Each job reports its state and progress until it is done, so
+# several incidents can queue up without blocking capture or the request.
+#
+# A job can also keep recording after the trigger. Its pre-event frames are
+# still encoded right away, since a ring-file snapshot is a set of views the
+# writer will overwrite, and only the open clip is kept while the post-event
+# window passes; then the frames captured meanwhile are appended and the
+# clip is closed. Clips are written at the measured capture rate, and
+# frames are placed by their capture timestamps, so playback runs at real
+# speed even when the camera was slower than nominal or frames were dropped.
+
+RECORDING, QUEUED, ENCODING, DONE, FAILED = "recording", "queued", "encoding", "done", "failed"
+
+
+class ClipWriter:
+    # Writes timestamped encoded frames to `path` at `fps`, in one or more
+    # add() calls. A frame is repeated to cover gaps in the capture and
+    # dropped when several land on one output slot; frames that fail to
+    # decode (e.g. overwritten in the ring) are skipped.
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.written = 0  # output frames
+        self._out = None
+        self._size = None
+        self._start = None
+
+    def add(self, frames, progress=None):
+        # progress(n) gets the frames of this call processed so far
+        for i, encoded in enumerate(frames):
+            frame = encoded.decode()
+            if frame is not None:
+                if self._out is None:
+                    # The first frame that decodes sets the size and the start
+                    height, width = frame.shape[:2]
+                    self._size = (width, height)
+                    self._start = encoded.timestamp
+                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                    self._out = cv2.VideoWriter(self.path, fourcc, self.fps, self._size)
+                    if not self._out.isOpened():
+                        self._out = None
+                        raise RuntimeError(f"Could not open video writer for {self.path}")
+                if (frame.shape[1], frame.shape[0]) != self._size:
+                    frame = cv2.resize(frame, self._size)
+                # Output slot of this frame on the clip's fixed-rate timeline
+                slot = int(round((encoded.timestamp - self._start) * self.fps))
+                for _ in range(slot - self.written + 1):
+                    self._out.write(frame)
+                    self.written += 1
+            if progress is not None and (i + 1) % 30 == 0:
+                progress(i + 1)
+        if progress is not None:
+            progress(len(frames))
+
+    def release(self):
+        if self._out is not None:
+            self._out.release()
+            self._out = None
+
+    def close(self):
+        # Returns the number of output frames; fails when none decoded
+        self.release()
+        if self.written == 0:
+            raise ValueError("None of the buffered frames could be decoded")
+        return self.written
+
+
+def write_clip(path, frames, fps=None, progress=None):
+    # Write timestamped EncodedFrames to `path` at `fps` (default: measured
+    # from the timestamps); returns the number of output frames
+    writer = ClipWriter(path, fps or measured_fps(frames))
+    try:
+        writer.add(frames, progress)
+    except Exception:
+        writer.release()
+        raise
+    return writer.close()
+
+
+class ClipExporter:
+    def __init__(self, output_dir='recordings', workers=2, keep_jobs=50):
+        # keep_jobs: finished jobs remembered for the status endpoint
+        self.output_dir = output_dir
+        self.keep_jobs = keep_jobs
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clip-export")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def submit(self, frames, fps=None, prefix='accident', source=None, until=None):
+        # Queue an export of `frames` and return its job ID right away. With
+        # a `source` buffer and an `until` timestamp, frames captured up to
+        # `until` are added from the source before the clip is closed.
+        # fps=None writes the clip at the measured capture rate.
+        frames = list(frames)
+        recording = source is not None and until is not None
+        created = datetime.now()
+        job_id = f"{created.strftime('%Y%m%d_%H%M%S')}_{next(self._ids)}"
+        path = os.path.join(self.output_dir, f"{prefix}_{job_id}.mp4")
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "path": path,
+            "frames": len(frames),
+            "written": 0,
+            "fps": fps,
+            "post_event_until": until if recording else None,
+            "created": created.isoformat(timespec='seconds'),
+            "seconds": None,
+            "error": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+        self._pool.submit(self._run, job, frames, source if recording else None, until)
+        return job_id
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+
+    def _fail(self, job, writer, error, elapsed):
+        if writer is not None:
+            writer.release()
+        self._update(job, status=FAILED, error=str(error), seconds=round(elapsed, 2))
+
+    def _run(self, job, frames, source, until):
+        # Encode the frames snapshotted at the trigger right away; a
+        # recording job then waits for the post-event window with the clip
+        # open, holding no frames
+        start = time.perf_counter()
+        self._update(job, status=ENCODING)
+        writer = None
+        try:
+            if not frames:
+                raise ValueError("No frames buffered")
+            os.makedirs(self.output_dir, exist_ok=True)
+            fps = job["fps"] or measured_fps(frames)
+            self._update(job, fps=round(fps, 2))
+            writer = ClipWriter(job["path"], fps)
+            writer.add(frames, progress=lambda n: self._update(job, written=n))
+            elapsed = time.perf_counter() - start
+            if source is None:
+                self._finish(job, writer, elapsed)
+                return
+            self._update(job, status=RECORDING)
+            timer = threading.Timer(
+                max(0.0, until - time.time()), self._pool.submit,
+                (self._record_post_event, job, writer, frames[-1].timestamp, source, until, elapsed)
+            )
+            timer.daemon = True
+            timer.start()
+        except Exception as e:
+            self._fail(job, writer, e, time.perf_counter() - start)
+
+    def _record_post_event(self, job, writer, last, source, until, elapsed):
+        # Post-event window is over: add what was captured since the trigger
+        start = time.perf_counter()
+        self._update(job, status=ENCODING)
+        try:
+            frames = [f for f in source.snapshot(since=last) if f.timestamp <= until]
+            done = job["written"]
+            self._update(job, frames=job["frames"] + len(frames))
+            writer.add(frames, progress=lambda n: self._update(job, written=done + n))
+            self._finish(job, writer, elapsed + time.perf_counter() - start)
+        except Exception as e:
+            self._fail(job, writer, e, elapsed + time.perf_counter() - start)
+
+    def _finish(self, job, writer, elapsed):
+        clip_frames = writer.close()
+        self._update(job, status=DONE, clip_frames=clip_frames, seconds=round(elapsed, 2))
+        print(f"Accident video saved to {job['path']}")
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond keep_jobs
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.keep_jobs)]:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        job["progress"] = round(job["written"] / job["frames"], 3) if job["frames"] else 0.0
+        return job
+
+    def jobs(self):
+        with self._lock:
+            job_ids = list(self._jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def active(self):
+        with self._lock:
+            return sum(job["status"] in (RECORDING, QUEUED, ENCODING) for job in self._jobs.values())
+
+    def close(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,200 @@
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+# Time-based drowsiness scoring for the rider camera.
+#
+# Landmarks are converted to one (68, 2) array per face and the eye and
+# mouth aspect ratios of every face are computed together with array
+# indexing. Scoring works on timestamps rather than frame counts, so the
+# alert timing is the same at 10 and at 30 FPS:
+#
+#   PERCLOS    share of the last `window` seconds with the eyes closed,
+#              each frame weighted by how long it was on screen
+#   closure    how long the eyes have been closed without a break
+#   yawn       how long the mouth has been open in a yawn without a break
+#
+# Eye closure and yawning are tracked separately; the rider is drowsy when
+# any of the three passes its threshold. Alarm playback runs on its own
+# thread (AlarmPlayer), so loading or starting the sound never stalls the
+# frame loop.
+
+# dlib 68-point indices: p1..p6 of each eye, and the mouth points used by
+# the original MAR (outer lip corners and two upper/lower pairs)
+LEFT_EYE = np.arange(36, 42)
+RIGHT_EYE = np.arange(42, 48)
+MOUTH = np.arange(48, 68)
+_EYES = np.stack([LEFT_EYE, RIGHT_EYE])
+
+
+def landmarks_to_array(landmarks):
+    # (68, 2) int32 array of a dlib full_object_detection
+    coords = np.fromiter(
+        (c for part in landmarks.parts() for c in (part.x, part.y)),
+        dtype=np.int32, count=2 * landmarks.num_parts
+    )
+    return coords.reshape(-1, 2)
+
+
+def _ratio(points, a, b, c):
+    # (|p_a0 - p_a1| + |p_b0 - p_b1|) / (2 |p_c0 - p_c1|) along the last axis
+    def dist(pair):
+        return np.linalg.norm(points[..., pair[0], :] - points[..., pair[1], :], axis=-1)
+    return (dist(a) + dist(b)) / (2.0 * np.maximum(dist(c), 1e-6))
+
+
+def aspect_ratios(points):
+    # Mean eye aspect ratio and mouth aspect ratio of (F, 68, 2) landmark
+    # arrays (or one (68, 2) array); returns two (F,) arrays
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 2:
+        points = points[None]
+    eyes = points[:, _EYES]  # (F, 2, 6, 2)
+    ear = _ratio(eyes, (1, 5), (2, 4), (0, 3)).mean(axis=1)
+    mar = _ratio(points[:, MOUTH], (2, 10), (4, 8), (0, 6))
+    return ear, mar
+
+
+class DrowsinessMonitor:
+    def __init__(self, ear_threshold=0.25, mar_threshold=1.0, window=30.0,
+                 perclos_threshold=0.25, closure_seconds=1.0, yawn_seconds=2.0,
+                 min_coverage=5.0, max_frame_gap=0.5):
+        # min_coverage: seconds of face data needed before PERCLOS can raise
+        # an alert; max_frame_gap caps the weight of one frame after a stall
+        self.ear_threshold = ear_threshold
+        self.mar_threshold = mar_threshold
+        self.window = window
+        self.perclos_threshold = perclos_threshold
+        self.closure_seconds = closure_seconds
+        self.yawn_seconds = yawn_seconds
+        self.min_coverage = min_coverage
+        self.max_frame_gap = max_frame_gap
+
+        self._samples = deque()  # (time, duration, closed)
+        self._total = 0.0
+        self._closed = 0.0
+        self._closed_since = None
+        self._yawning_since = None
+        self._last_time = None
+        self._last_face_time = None
+        self.drowsy = False
+
+    def _evict(self, now):
+        while self._samples and self._samples[0][0] < now - self.window:
+            _, duration, closed = self._samples.popleft()
+            self._total -= duration
+            if closed:
+                self._closed -= duration
+
+    @property
+    def perclos(self):
+        return self._closed / self._total if self._total > 0 else 0.0
+
+    def update(self, points, frame_time):
+        # One frame: the rider's (68, 2) landmarks, or None when no face was
+        # found (the frame then only ages the window). A closure or yawn in
+        # progress survives a missed detection, but is dropped once no face
+        # has been seen for max_frame_gap seconds. Returns a state dict.
+        duration = 0.0
+        if self._last_time is not None:
+            duration = min(max(frame_time - self._last_time, 0.0), self.max_frame_gap)
+        self._last_time = frame_time
+
+        state = {'ear': None, 'mar': None, 'eye_closed': False, 'yawning': False}
+        if points is not None:
+            ear, mar = aspect_ratios(points)
+            ear, mar = float(ear[0]), float(mar[0])
+            eye_closed = ear < self.ear_threshold
+            yawning = mar > self.mar_threshold
+            self._samples.append((frame_time, duration, eye_closed))
+            self._total += duration
+            if eye_closed:
+                self._closed += duration
+                if self._closed_since is None:
+                    self._closed_since = frame_time
+            else:
+                self._closed_since = None
+            if yawning:
+                if self._yawning_since is None:
+                    self._yawning_since = frame_time
+            else:
+                self._yawning_since = None
+            self._last_face_time = frame_time
+            state.update(ear=ear, mar=mar, eye_closed=eye_closed, yawning=yawning)
+        elif self._last_face_time is None or frame_time - self._last_face_time > self.max_frame_gap:
+            self._closed_since = self._yawning_since = None
+        self._evict(frame_time)
+
+        closed_for = 0.0 if self._closed_since is None else frame_time - self._closed_since
+        yawning_for = 0.0 if self._yawning_since is None else frame_time - self._yawning_since
+        perclos = self.perclos
+        self.drowsy = bool(
+            closed_for >= self.closure_seconds
+            or yawning_for >= self.yawn_seconds
+            or (self._total >= self.min_coverage and perclos >= self.perclos_threshold)
+        )
+        state.update(perclos=perclos, closed_for=closed_for, yawning_for=yawning_for,
+                     drowsy=self.drowsy)
+        return state
+
+    def reset(self):
+        self._samples.clear()
+        self._total = self._closed = 0.0
+        self._closed_since = self._yawning_since = None
+        self._last_time = self._last_face_time = None
+        self.drowsy = False
+
+
+class AlarmPlayer:
+    # Looping alarm sound driven from a worker thread. set(True/False) only
+    # records the wanted state; the worker loads the sound once and starts or
+    # stops playback when the state changes. `available` is None while the
+    # sound loads and False if it could not be loaded (no audio device,
+    # missing file or pygame), so the caller can fall back to another alert.
+    def __init__(self, sound_path):
+        self.sound_path = sound_path
+        self.playing = False
+        self.available = None
+        self.error = None
+        self._wanted = False
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="alarm", daemon=True)
+        self._thread.start()
+
+    def set(self, on):
+        # Cheap enough to call every frame; only changes reach the worker
+        on = bool(on)
+        if on != self._wanted:
+            self._wanted = on
+            self._requests.put(on)
+
+    def _run(self):
+        try:
+            import pygame
+            pygame.mixer.init()
+            pygame.mixer.music.load(self.sound_path)
+        except Exception as e:
+            self.error = e
+            self.available = False
+            print(f"Alarm sound unavailable ({self.sound_path}): {e}")
+            return
+        self.available = True
+        while True:
+            on = self._requests.get()
+            # Only the latest request matters
+            while not self._requests.empty():
+                on = self._requests.get_nowait()
+            if on is None:
+                break
+            if on and not pygame.mixer.music.get_busy():
+                pygame.mixer.music.play(-1)  # Play in loop
+            elif not on and self.playing:
+                pygame.mixer.music.stop()
+            self.playing = on
+        pygame.mixer.music.stop()
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join(timeout=2.0)
@@ -1,107 +1,109 @@
+import time
 import cv2
 import dlib
 import numpy as np
-from scipy.spatial import distance
-import pygame
+from drowsiness_monitor import AlarmPlayer, DrowsinessMonitor, landmarks_to_array
+from face_tracker import FaceTracker
 
-# Initialize pygame mixer for playing sound
-pygame.mixer.init()
 alarm_sound = "Gong.mp3"  # Replace with your alert sound file
 
-# Load dlib’s face detector and landmark predictor
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
-
-# Define eye aspect ratio function
-def eye_aspect_ratio(eye):
-    A = distance.euclidean(eye[1], eye[5])
-    B = distance.euclidean(eye[2], eye[4])
-    C = distance.euclidean(eye[0], eye[3])
-    return (A + B) / (2.0 * C)
-
-# Define mouth aspect ratio function
-def mouth_aspect_ratio(mouth):
-    A = distance.euclidean(mouth[2], mouth[10])  # Top lip to bottom lip
-    B = distance.euclidean(mouth[4], mouth[8])   # More lip distance
-    C = distance.euclidean(mouth[0], mouth[6])   # Horizontal width
-    return (A + B) / (2.0 * C)
-
 # Threshold values for drowsiness detection
 EYE_AR_THRESH = 0.25
 MOUTH_AR_THRESH = 1.0
-DROWSY_THRESHOLD = 30  # Number of frames before drowsy alert
-ALARM_PLAYING = False  # To track if alarm is playing
-
-# Start video capture (0 for webcam)
-video_cap = cv2.VideoCapture(0)
-
-drowsy_score = 0
-
-while True:
-    ret, frame = video_cap.read()
-    if not ret:
-        break
-
-    frame = cv2.resize(frame, (800, 500))
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Detect faces
-    faces = detector(gray)
-
-    for face in faces:
-        landmarks = predictor(gray, face)
-
-        # Extract eye and mouth points
-        left_eye = np.array([(landmarks.part(i).x, landmarks.part(i).y) for i in range(36, 42)])
-        right_eye = np.array([(landmarks.part(i).x, landmarks.part(i).y) for i in range(42, 48)])
-        mouth = np.array([(landmarks.part(i).x, landmarks.part(i).y) for i in range(48, 68)])
-
-        # Calculate aspect ratios
-        ear_left = eye_aspect_ratio(left_eye)
-        ear_right = eye_aspect_ratio(right_eye)
-        ear_avg = (ear_left + ear_right) / 2.0
-        mar = mouth_aspect_ratio(mouth)
-
-        # Draw facial landmarks
-        for (x, y) in np.vstack([left_eye, right_eye, mouth]):
-            cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
-
-        # Check drowsiness conditions
-        eye_closed = ear_avg < EYE_AR_THRESH
-        yawning = mar > MOUTH_AR_THRESH
-
-        if eye_closed or yawning:
-            drowsy_score += 1
-        else:
-            drowsy_score = max(drowsy_score - 1, 0)
-
-        # Display alerts based on drowsy_score
-        if drowsy_score >= DROWSY_THRESHOLD:
-            cv2.putText(frame, "DROWSY ALERT!", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 3)
-
-            # Play alarm if not already playing
-            if not pygame.mixer.music.get_busy():
-                pygame.mixer.music.load(alarm_sound)
-                pygame.mixer.music.play(-1)  # Play in loop
-                ALARM_PLAYING = True
-
-        else:
-            # Stop alarm if drowsiness is resolved
-            if ALARM_PLAYING:
-                pygame.mixer.music.stop()
-                ALARM_PLAYING = False
-
-        # Display score
-        cv2.putText(frame, f"Score: {drowsy_score}", (20, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-    # Show the frame
-    cv2.imshow('Drowsiness Detection', frame)
-
-    # Exit on key press
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-# Cleanup
-video_cap.release()
-cv2.destroyAllWindows()
-pygame.mixer.music.stop()  # Ensure sound stops when the program ends
+# Alert timing is in seconds, so it does not depend on the frame rate. The
+# alarm fires on any of: eyes closed for CLOSURE_SECONDS in a row, eyes
+# closed for PERCLOS_THRESHOLD of the last PERCLOS_WINDOW seconds (PERCLOS),
+# or a yawn lasting YAWN_SECONDS in a row
+CLOSURE_SECONDS = 1.0
+PERCLOS_WINDOW = 30.0
+PERCLOS_THRESHOLD = 0.25
+YAWN_SECONDS = 2.0
+
+# Face tracking: the full-frame HOG detector only runs every
+# REDETECT_INTERVAL frames or when the face is lost, otherwise just a small
+# ROI around the last face is searched. Set FACE_TRACKING = False to detect
+# on every full frame.
+FACE_TRACKING = True
+REDETECT_INTERVAL = 30
+
+# Load dlib's face detector and landmark predictor
+def load_models():
+    detector = dlib.get_frontal_face_detector()
+    predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
+    return detector, predictor
+
+# (F, 68, 2) landmarks of every face, largest (the rider) first
+def face_landmarks(gray, faces, predictor):
+    faces = sorted(faces, key=lambda r: r.width() * r.height(), reverse=True)
+    if not faces:
+        return np.empty((0, 68, 2), dtype=np.int32)
+    return np.stack([landmarks_to_array(predictor(gray, face)) for face in faces])
+
+def main():
+    # Alarm sound is loaded and played on its own thread
+    alarm = AlarmPlayer(alarm_sound)
+    monitor = DrowsinessMonitor(
+        ear_threshold=EYE_AR_THRESH, mar_threshold=MOUTH_AR_THRESH, window=PERCLOS_WINDOW,
+        perclos_threshold=PERCLOS_THRESHOLD, closure_seconds=CLOSURE_SECONDS,
+        yawn_seconds=YAWN_SECONDS
+    )
+
+    detector, predictor = load_models()
+    face_tracker = FaceTracker(detector, redetect_interval=REDETECT_INTERVAL) if FACE_TRACKING else None
+
+    # Start video capture (0 for webcam)
+    video_cap = cv2.VideoCapture(0)
+
+    try:
+        while True:
+            ret, frame = video_cap.read()
+            if not ret:
+                break
+
+            frame_time = time.monotonic()
+            frame = cv2.resize(frame, (800, 500))
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            # Detect (or track) faces
+            faces = face_tracker.update(gray) if face_tracker else detector(gray)
+            points = face_landmarks(gray, faces, predictor)
+
+            # Draw facial landmarks (eyes and mouth)
+            for (x, y) in points[:, 36:68].reshape(-1, 2).tolist():
+                cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
+
+            # Score the rider's face; frames without a face only age the window
+            state = monitor.update(points[0] if len(points) else None, frame_time)
+            alarm.set(state['drowsy'])
+
+            if len(points):
+                # Display alerts based on the time-based score
+                if state['drowsy']:
+                    cv2.putText(frame, "DROWSY ALERT!", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 3)
+                    if alarm.available is False:
+                        # No sound: flash a red border and ring the terminal bell
+                        if int(frame_time * 4) % 2 == 0:
+                            cv2.rectangle(frame, (0, 0), (frame.shape[1] - 1, frame.shape[0] - 1), (0, 0, 255), 20)
+                        print("\a", end="", flush=True)
+
+                # Display score
+                score = (f"PERCLOS: {state['perclos']:.0%}  Closed: {state['closed_for']:.1f}s"
+                         f"  Yawn: {state['yawning_for']:.1f}s")
+                cv2.putText(frame, score, (20, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+            # Show the frame
+            cv2.imshow('Drowsiness Detection', frame)
+
+            # Exit on key press
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        # Cleanup
+        if face_tracker:
+            print(f"Face tracking stats: {face_tracker.stats()}")
+        video_cap.release()
+        cv2.destroyAllWindows()
+        alarm.close()  # Ensure sound stops when the program ends
+
+if __name__ == "__main__":
+    main()
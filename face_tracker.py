@@ -0,0 +1,101 @@
+import cv2
+import dlib
+import numpy as np
+
+# Track-then-detect face finding for the rider camera.
+#
+# dlib's HOG face detector is by far the most expensive step of the
+# drowsiness loop, and the rider's face barely moves between frames. The
+# full-frame detector only runs every `redetect_interval` frames or when the
+# face is lost; in between the detector only searches a small ROI around the
+# last face (`roi_margin` face sizes on each side), optionally downscaled.
+# Faces are returned as dlib rectangles in full-frame coordinates, so the
+# landmark predictor is used exactly as before.
+
+
+def _scaled(image, scale):
+    if scale == 1.0:
+        return np.ascontiguousarray(image)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _to_frame(rect, scale, x0=0, y0=0):
+    return dlib.rectangle(
+        int(round(rect.left() / scale)) + x0, int(round(rect.top() / scale)) + y0,
+        int(round(rect.right() / scale)) + x0, int(round(rect.bottom() / scale)) + y0
+    )
+
+
+def _largest(rects):
+    # The rider is the closest (largest) face in view
+    if len(rects) == 0:
+        return None
+    return max(rects, key=lambda r: r.width() * r.height())
+
+
+class FaceTracker:
+    def __init__(self, detector=None, redetect_interval=30, roi_margin=0.5,
+                 detect_scale=1.0, roi_scale=1.0):
+        # detect_scale / roi_scale shrink the image handed to the detector
+        # for full and ROI searches; HOG needs faces of about 80 px, so only
+        # scale down when the face is comfortably larger than that
+        self.detector = detector or dlib.get_frontal_face_detector()
+        self.redetect_interval = redetect_interval
+        self.roi_margin = roi_margin
+        self.detect_scale = detect_scale
+        self.roi_scale = roi_scale
+
+        self.face = None
+        self.frames_since_detection = 0
+        self.detections = 0
+        self.tracked = 0
+        self.lost = 0
+
+    def _detect(self, gray):
+        self.detections += 1
+        self.frames_since_detection = 0
+        face = _largest(self.detector(_scaled(gray, self.detect_scale)))
+        if face is None:
+            return None
+        return _to_frame(face, self.detect_scale)
+
+    def _roi(self, shape):
+        height, width = shape[:2]
+        face = self.face
+        pad_x = int(face.width() * self.roi_margin)
+        pad_y = int(face.height() * self.roi_margin)
+        x0, y0 = max(0, face.left() - pad_x), max(0, face.top() - pad_y)
+        x1, y1 = min(width, face.right() + pad_x), min(height, face.bottom() + pad_y)
+        return x0, y0, x1, y1
+
+    def _search_roi(self, gray):
+        x0, y0, x1, y1 = self._roi(gray.shape)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        face = _largest(self.detector(_scaled(gray[y0:y1, x0:x1], self.roi_scale)))
+        if face is None:
+            return None
+        return _to_frame(face, self.roi_scale, x0, y0)
+
+    def update(self, gray):
+        # Faces (zero or one dlib rectangle) of this grayscale frame
+        face = None
+        if self.face is not None and self.frames_since_detection < self.redetect_interval:
+            face = self._search_roi(gray)
+            if face is not None:
+                self.tracked += 1
+                self.frames_since_detection += 1
+            else:
+                self.lost += 1
+        if face is None:
+            face = self._detect(gray)
+
+        self.face = face
+        return [] if face is None else [face]
+
+    def stats(self):
+        return {
+            "detections": self.detections,
+            "tracked": self.tracked,
+            "lost": self.lost
+        }
@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+
+# Shared per-frame dense optical flow.
+#
+# The grayscale conversion and the Farneback flow are computed once per
+# frame, either over the whole (downscaled) frame or only over the union of
+# the detection boxes. Every detection then reads its motion statistics from
+# the shared result through an integral image, so the per-box cost is a few
+# array lookups no matter how many vehicles are in view.
+
+FARNEBACK_PARAMS = dict(
+    pyr_scale=0.5,
+    levels=3,
+    winsize=15,
+    iterations=3,
+    poly_n=5,
+    poly_sigma=1.2,
+    flags=0
+)
+
+
+class FlowEngine:
+    def __init__(self, scale=0.5, mode="full", roi_padding=16, farneback_params=None):
+        if mode not in ("full", "roi"):
+            raise ValueError(f"Unknown flow mode: {mode}")
+        self.scale = scale
+        self.mode = mode
+        self.roi_padding = roi_padding
+        self.params = dict(FARNEBACK_PARAMS, **(farneback_params or {}))
+        self.prev_gray = None
+        self.flow = None
+        self.magnitude = None
+        self._integral = None
+        self._origin = (0, 0)  # top-left of the flow region, in scaled pixels
+
+    def reset(self):
+        self.prev_gray = None
+        self.flow = None
+        self.magnitude = None
+        self._integral = None
+
+    def _to_gray(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                              interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _flow_region(self, boxes, shape):
+        height, width = shape
+        if self.mode == "full" or boxes is None or len(boxes) == 0:
+            return 0, 0, width, height
+        scaled = np.asarray(boxes, dtype=np.float32) * self.scale
+        x1 = max(0, int(scaled[:, 0].min()) - self.roi_padding)
+        y1 = max(0, int(scaled[:, 1].min()) - self.roi_padding)
+        x2 = min(width, int(np.ceil(scaled[:, 2].max())) + self.roi_padding)
+        y2 = min(height, int(np.ceil(scaled[:, 3].max())) + self.roi_padding)
+        return x1, y1, x2, y2
+
+    def update(self, frame, boxes=None):
+        # Advance one frame. `boxes` is an (N, 4) array of x1, y1, x2, y2 in
+        # frame pixels; an empty array skips the flow computation, and the
+        # union of the boxes bounds it in "roi" mode. Returns False when no
+        # flow was computed for this frame.
+        gray = self._to_gray(frame)
+        prev_gray, self.prev_gray = self.prev_gray, gray
+        self.flow = self.magnitude = self._integral = None
+
+        if prev_gray is None or prev_gray.shape != gray.shape:
+            return False
+        # Nothing to measure on an empty road; only the frame is remembered
+        if boxes is not None and len(boxes) == 0:
+            return False
+
+        x1, y1, x2, y2 = self._flow_region(boxes, gray.shape)
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return False
+
+        self.flow = cv2.calcOpticalFlowFarneback(
+            prev_gray[y1:y2, x1:x2], gray[y1:y2, x1:x2], None, **self.params
+        )
+        # Report motion in full-resolution pixels regardless of the scale
+        self.magnitude = cv2.magnitude(self.flow[..., 0], self.flow[..., 1]) / self.scale
+        self._integral = cv2.integral(self.magnitude, sdepth=cv2.CV_64F)
+        self._origin = (x1, y1)
+        return True
+
+    def box_motion(self, boxes):
+        # Mean flow magnitude inside each box, NaN where there is no flow or
+        # the box covers fewer than 2x2 flow pixels
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        motion = np.full(len(boxes), np.nan)
+        if self._integral is None or len(boxes) == 0:
+            return motion
+
+        height, width = self.magnitude.shape
+        ox, oy = self._origin
+        scaled = np.rint(boxes * self.scale).astype(np.int64)
+        x1 = np.clip(scaled[:, 0] - ox, 0, width)
+        y1 = np.clip(scaled[:, 1] - oy, 0, height)
+        x2 = np.clip(scaled[:, 2] - ox, 0, width)
+        y2 = np.clip(scaled[:, 3] - oy, 0, height)
+
+        area = (x2 - x1) * (y2 - y1)
+        valid = ((x2 - x1) > 1) & ((y2 - y1) > 1)
+        ii = self._integral
+        sums = ii[y2, x2] - ii[y1, x2] - ii[y2, x1] + ii[y1, x1]
+        motion[valid] = sums[valid] / area[valid]
+        return motion
+
+    def region_motion(self, bbox):
+        return float(self.box_motion([bbox])[0])
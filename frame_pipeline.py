@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+
+# Long-lived multi-stage frame pipeline.
+#
+# Each stage runs on its own thread and the stages are chained with bounded
+# queues, so capture, lane detection, YOLO, scoring and rendering of
+# consecutive frames overlap instead of running back to back. OpenCV and
+# torch release the GIL inside their kernels, so the stages really do run
+# in parallel on a multi-core CPU.
+
+_CLOSED = object()
+
+
+class BoundedQueue:
+    def __init__(self, maxsize=2, drop_oldest=True, on_drop=None):
+        # on_drop(item) is called, outside the lock, with every item the
+        # drop-oldest policy discards
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._items = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        dropped = None
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.drop_oldest:
+                    # Real-time policy: the stale frame goes, the new one stays
+                    dropped = self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return False
+            self._items.append(item)
+            self._cond.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return True
+
+    def get(self, timeout=None):
+        # Returns _CLOSED once the queue is closed and drained
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                if self._closed:
+                    return _CLOSED
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("queue get timed out")
+                self._cond.wait(remaining)
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class PipelineStage:
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.processed = 0
+        self.total_time = 0.0
+        self.error = None
+
+    @property
+    def avg_latency_ms(self):
+        if self.processed == 0:
+            return 0.0
+        return 1000.0 * self.total_time / self.processed
+
+    def run(self, in_queue, out_queue, stop_event):
+        try:
+            while not stop_event.is_set():
+                packet = in_queue.get()
+                if packet is _CLOSED:
+                    break
+                start = time.perf_counter()
+                result = self.fn(packet)
+                self.total_time += time.perf_counter() - start
+                self.processed += 1
+                # A stage may return None to filter a packet out
+                if result is not None:
+                    out_queue.put(result)
+        except Exception as e:
+            self.error = e
+            stop_event.set()
+        finally:
+            # Closing the input too unblocks an upstream stage waiting on a
+            # full queue if this stage died
+            in_queue.close()
+            out_queue.close()
+
+
+class FramePipeline:
+    # `source` is called repeatedly on the capture thread and returns the next
+    # packet, or None at end of stream. Every stage function takes a packet
+    # and returns the (possibly updated) packet. Finished packets come back on
+    # the caller's thread through `results()`, which keeps `cv2.imshow` on the
+    # main thread.
+    #
+    # With drop_oldest=True a full queue discards its oldest packet, so the
+    # pipeline always works on the freshest frame instead of falling behind
+    # the camera. Use drop_oldest=False for video files where every frame
+    # must be processed. on_drop(packet) gets every discarded packet, e.g. to
+    # give its pooled buffers back.
+
+    def __init__(self, source, stages, queue_size=2, drop_oldest=True, on_drop=None):
+        self.source = source
+        self.stages = [PipelineStage(name, fn) for name, fn in stages]
+        self.queues = [
+            BoundedQueue(queue_size, drop_oldest, on_drop)
+            for _ in range(len(self.stages) + 1)
+        ]
+        self.captured = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._capture_error = None
+
+    def _capture_loop(self):
+        first = self.queues[0]
+        try:
+            while not self._stop.is_set():
+                packet = self.source()
+                if packet is None:
+                    break
+                self.captured += 1
+                first.put(packet)
+        except Exception as e:
+            self._capture_error = e
+            self._stop.set()
+        finally:
+            first.close()
+
+    def start(self):
+        if self._threads:
+            return self
+        self._threads.append(
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True)
+        )
+        for i, stage in enumerate(self.stages):
+            self._threads.append(threading.Thread(
+                target=stage.run,
+                args=(self.queues[i], self.queues[i + 1], self._stop),
+                name=stage.name,
+                daemon=True
+            ))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def results(self):
+        self.start()
+        out = self.queues[-1]
+        while True:
+            packet = out.get()
+            if packet is _CLOSED:
+                break
+            yield packet
+        self._raise_errors()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        for q in self.queues:
+            q.close()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def _raise_errors(self):
+        if self._capture_error is not None:
+            raise self._capture_error
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def stats(self):
+        return {
+            "captured": self.captured,
+            "dropped": {
+                # Queue i feeds stage i; the last one feeds results()
+                name: q.dropped
+                for name, q in zip([s.name for s in self.stages] + ["output"], self.queues)
+            },
+            "stages": {
+                stage.name: {
+                    "processed": stage.processed,
+                    "avg_latency_ms": stage.avg_latency_ms
+                }
+                for stage in self.stages
+            }
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
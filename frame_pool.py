@@ -0,0 +1,120 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Reusable frame buffers for the per-frame resize, overlay and blend work.
+#
+# At 1280x720 every full-frame temporary is 2.7 MB, and the scripts used to
+# make several per frame (the resized frame, its copy for the overlay, the
+# zeroed lane image and the addWeighted result). The pool hands out the same
+# memory again instead:
+#
+#   scratch(name, shape)  a named buffer reused on every call, for loops that
+#                         are done with the previous frame's buffer before
+#                         asking for the next one
+#   acquire(shape)        a buffer of its own, for frames that travel between
+#                         threads; give it back with release() when done
+#
+# blend_polygon() tints a polygon in place and only touches the pixels of the
+# polygon's bounding box, instead of blending a whole overlay frame.
+#
+# Scratch buffers are not locked; give each thread that uses them its own
+# pool. acquire() and release() may be called from any thread.
+
+
+class FramePool:
+    def __init__(self, max_free=8):
+        # max_free: released buffers kept per shape; more are left to the GC
+        self.max_free = max_free
+        self._scratch = {}
+        self._free = {}
+        self._lock = threading.Lock()
+        self._color_fill = (None, 0)  # colour of the blend_color buffer, pixels filled
+        self.allocations = 0
+
+    def scratch(self, name, shape, dtype=np.uint8):
+        # Contiguous view of a named backing buffer that grows to the largest
+        # size asked for, so varying shapes (bounding boxes) do not allocate
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        backing = self._scratch.get(name)
+        if backing is None or backing.dtype != dtype or backing.size < size:
+            backing = np.empty(size, dtype=dtype)
+            self._scratch[name] = backing
+            self.allocations += 1
+        return backing[:size].reshape(shape)
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array):
+        if array is None:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if len(free) < self.max_free:
+                free.append(array)
+
+    def resize(self, frame, size, name=None, interpolation=cv2.INTER_LINEAR):
+        # cv2.resize into a pooled buffer: the named scratch buffer, or an
+        # acquired one when no name is given. size is (width, height).
+        width, height = size
+        shape = (height, width) + frame.shape[2:]
+        if name is None:
+            dst = self.acquire(shape, frame.dtype)
+        else:
+            dst = self.scratch(name, shape, frame.dtype)
+        return cv2.resize(frame, (width, height), dst=dst, interpolation=interpolation)
+
+    def blend_polygon(self, image, polygon, color, alpha, beta, gamma=0.0):
+        # In place on a BGR image: image * alpha + color * beta + gamma inside
+        # the polygon; pixels outside it are left as they are
+        height, width = image.shape[:2]
+        polygon = np.asarray(polygon, dtype=np.int32).reshape(-1, 2)
+        x0, y0 = np.clip(polygon.min(axis=0), 0, (width, height))
+        x1, y1 = np.clip(polygon.max(axis=0) + 1, 0, (width, height))
+        if x1 <= x0 or y1 <= y0:
+            return image
+
+        roi = image[y0:y1, x0:x1]
+        box_shape = (y1 - y0, x1 - x0)
+        mask = self.scratch('blend_mask', box_shape)
+        mask[:] = 0
+        cv2.fillPoly(mask, [polygon - (x0, y0)], 255)
+
+        # Solid colour patch; every pixel is the same, so it is only refilled
+        # when the colour changes or the patch grows
+        color = tuple(int(c) for c in color[:3])
+        pixels = box_shape[0] * box_shape[1]
+        patch = self.scratch('blend_color', box_shape + (3,))
+        filled_color, filled = self._color_fill
+        if filled_color != color or filled < pixels:
+            patch[:] = color
+            self._color_fill = (color, pixels)
+
+        # Blend the bounding box in contiguous buffers, keep the blended
+        # pixels inside the polygon and write the box back
+        work = self.scratch('blend_work', roi.shape)
+        blended = self.scratch('blend_out', roi.shape)
+        np.copyto(work, roi)
+        cv2.addWeighted(work, alpha, patch, beta, gamma, dst=blended)
+        cv2.copyTo(blended, mask, work)
+        roi[:] = work
+        return image
+
+    def stats(self):
+        with self._lock:
+            free = sum(len(v) for v in self._free.values())
+        return {
+            "allocations": self.allocations,
+            "scratch_bytes": sum(b.nbytes for b in self._scratch.values()),
+            "free_buffers": free
+        }
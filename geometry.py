@@ -0,0 +1,125 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Batched geometry shared by the vision scripts.
+#
+# Boxes are (N, 4) arrays of x1, y1, x2, y2 and lane lines are the scripts'
+# [x_bottom, y_bottom, x_top, y_top] lists. Point-in-polygon tests look the
+# points up in a rasterized mask of the polygon, which is built once per
+# polygon and cached, so testing every box of a frame is one fancy-indexing
+# call instead of a cv2.pointPolygonTest per box.
+
+_MASK_CACHE_SIZE = 16
+_mask_cache = OrderedDict()
+
+
+def as_boxes(boxes, dtype=np.float32):
+    return np.asarray(boxes, dtype=dtype).reshape(-1, 4)
+
+
+def box_centers(boxes):
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) // 2, (boxes[:, 1] + boxes[:, 3]) // 2], axis=1)
+
+
+def box_bottom_centers(boxes):
+    # Where a vehicle touches the road
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) // 2, boxes[:, 3]], axis=1)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    boxes_a = as_boxes(boxes_a)
+    boxes_b = as_boxes(boxes_b)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def overlap_matrix(boxes_a, boxes_b):
+    # (N, M) bool, True where the boxes' interiors intersect
+    a = as_boxes(boxes_a)
+    b = as_boxes(boxes_b)
+    return (
+        (a[:, None, 0] < b[None, :, 2]) & (a[:, None, 2] > b[None, :, 0])
+        & (a[:, None, 1] < b[None, :, 3]) & (a[:, None, 3] > b[None, :, 1])
+    )
+
+
+def _polygon_mask(vertices):
+    # Mask over the polygon's bounding box, and that box's top-left corner
+    polygon = np.rint(np.asarray(vertices, dtype=np.float64).reshape(-1, 2)).astype(np.int32)
+    key = polygon.tobytes()
+    cached = _mask_cache.get(key)
+    if cached is not None:
+        _mask_cache.move_to_end(key)
+        return cached
+
+    origin = polygon.min(axis=0)
+    size = polygon.max(axis=0) - origin + 1
+    mask = np.zeros((size[1], size[0]), dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon - origin], 1)
+    cached = (mask.astype(bool), origin)
+    _mask_cache[key] = cached
+    if len(_mask_cache) > _MASK_CACHE_SIZE:
+        _mask_cache.popitem(last=False)
+    return cached
+
+
+def points_in_polygon(points, vertices):
+    # (N,) bool for (N, 2) x, y points; polygon edges count as inside
+    points = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 2)).astype(np.int64)
+    mask, origin = _polygon_mask(vertices)
+    local = points - origin
+    height, width = mask.shape
+    inside = (
+        (local[:, 0] >= 0) & (local[:, 0] < width)
+        & (local[:, 1] >= 0) & (local[:, 1] < height)
+    )
+    result = np.zeros(len(points), dtype=bool)
+    result[inside] = mask[local[inside, 1], local[inside, 0]]
+    return result
+
+
+def boxes_in_polygon(boxes, vertices):
+    # Boxes whose bottom center lies in the polygon
+    return points_in_polygon(box_bottom_centers(boxes), vertices)
+
+
+def lane_polygon(left_line, right_line):
+    return [
+        (left_line[0], left_line[1]),
+        (left_line[2], left_line[3]),
+        (right_line[2], right_line[3]),
+        (right_line[0], right_line[1])
+    ]
+
+
+def line_x_at(line, ys):
+    # x of a lane line at rows `ys`, extrapolated beyond its end points
+    x1, y1, x2, y2 = (float(v) for v in line)
+    ys = np.asarray(ys, dtype=np.float64)
+    if y2 == y1:
+        return np.full(ys.shape, (x1 + x2) / 2.0)
+    return x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+
+
+def distance_to_lane(boxes, left_line, right_line):
+    # Signed horizontal distance in pixels from every box's bottom center to
+    # the nearer lane line at that row: positive inside the lane, negative
+    # outside it. Also returns the lane center and width at those rows.
+    points = box_bottom_centers(as_boxes(boxes, np.float64))
+    left = line_x_at(left_line, points[:, 1])
+    right = line_x_at(right_line, points[:, 1])
+    distance = np.minimum(points[:, 0] - left, right - points[:, 0])
+    return distance, (left + right) / 2.0, right - left
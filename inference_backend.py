@@ -0,0 +1,221 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from detection_planner import results_to_arrays
+
+# Pluggable inference backends behind the detection call sites.
+#
+# "torch" runs the .pt weights in eager PyTorch as before. "onnx" and
+# "torchscript" export the weights once (cached next to the .pt file) and
+# run the exported graph; "onnx" can additionally be INT8-quantized with
+# onnxruntime dynamic quantization. Every backend is warmed up at load time
+# so the first camera frame does not pay for graph initialisation, and
+# exposes both the YOLO-style `backend(frame)` call used by the scripts and
+# a plain `detect(frames) -> arrays` interface.
+#
+#   python inference_backend.py yolov8n.pt --backend onnx --int8 --video ride.mp4
+#
+# exports the model and checks its detections against the PyTorch path.
+# ultralytics is only imported when a model is loaded or exported, so the
+# rest of the pipeline can be imported (and benchmarked) without it.
+
+BACKENDS = ('torch', 'onnx', 'torchscript')
+
+
+def _is_stale(exported_path, weights):
+    return (
+        not os.path.exists(exported_path)
+        or os.path.getmtime(exported_path) < os.path.getmtime(weights)
+    )
+
+
+def export_model(weights, backend, imgsz=640, int8=False):
+    # Returns the path of the exported (and optionally quantized) model,
+    # re-exporting only when the .pt file is newer than the cached export
+    if backend not in ('onnx', 'torchscript'):
+        raise ValueError(f"Cannot export to backend '{backend}'")
+    if int8 and backend != 'onnx':
+        raise ValueError("INT8 quantization is only supported for the onnx backend")
+
+    stem = os.path.splitext(weights)[0]
+    exported = f"{stem}.onnx" if backend == 'onnx' else f"{stem}.torchscript"
+    if _is_stale(exported, weights):
+        from ultralytics import YOLO
+        # Dynamic axes let the detection planner change imgsz per frame
+        exported = YOLO(weights).export(
+            format=backend, imgsz=imgsz, dynamic=(backend == 'onnx')
+        )
+
+    if not int8:
+        return exported
+
+    quantized = f"{stem}.int8.onnx"
+    if _is_stale(quantized, exported):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(
+            exported, quantized,
+            op_types_to_quantize=['Conv', 'MatMul'],
+            weight_type=QuantType.QUInt8
+        )
+    return quantized
+
+
+class InferenceBackend:
+    name = 'base'
+    # Exported TorchScript graphs are traced at one input size
+    fixed_imgsz = None
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        if self.fixed_imgsz is not None:
+            kwargs['imgsz'] = self.fixed_imgsz
+        kwargs.setdefault('verbose', False)
+        return self.model(source, **kwargs)
+
+    def detect(self, frames, **kwargs):
+        # One (boxes, confs, classes) tuple of arrays per input frame
+        return [results_to_arrays([r]) for r in self(list(frames), **kwargs)]
+
+    def warmup(self, imgsz=640, runs=2):
+        dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        for _ in range(runs):
+            self(dummy, imgsz=imgsz)
+        return self
+
+
+class TorchBackend(InferenceBackend):
+    name = 'torch'
+
+    def __init__(self, weights, device=None):
+        from ultralytics import YOLO
+        model = YOLO(weights)
+        if device is not None:
+            model.to(device)
+        super().__init__(model)
+
+
+class ExportedBackend(InferenceBackend):
+    def __init__(self, weights, backend='onnx', imgsz=640, int8=False):
+        self.name = f"{backend}-int8" if int8 else backend
+        if backend == 'torchscript':
+            self.fixed_imgsz = imgsz
+        path = weights
+        if weights.endswith('.pt'):
+            path = export_model(weights, backend, imgsz=imgsz, int8=int8)
+        from ultralytics import YOLO
+        super().__init__(YOLO(path, task='detect'))
+
+
+def load_backend(weights, backend='torch', imgsz=640, int8=False, warmup=True, device=None,
+                 fallback=False):
+    # fallback: load the eager PyTorch model instead when an exported
+    # backend cannot be used (e.g. onnxruntime is missing or export fails)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    if backend == 'torch':
+        if int8:
+            raise ValueError("INT8 quantization is only supported for the onnx backend")
+        model = TorchBackend(weights, device=device)
+    else:
+        try:
+            model = ExportedBackend(weights, backend=backend, imgsz=imgsz, int8=int8)
+        except Exception as e:
+            if not fallback:
+                raise
+            print(f"Could not load {backend} backend ({e}), falling back to torch")
+            model = TorchBackend(weights, device=device)
+    if warmup:
+        model.warmup(imgsz=imgsz)
+    return model
+
+
+def check_parity(reference, candidate, frames, iou_threshold=0.5, conf=0.25, **kwargs):
+    # Compare the detections of two backends frame by frame. A reference box
+    # counts as reproduced when the candidate has a box of the same class
+    # overlapping it by at least `iou_threshold`.
+    from geometry import iou_matrix
+
+    matched = total = extra = 0
+    ious, conf_diffs = [], []
+    for frame in frames:
+        ref_boxes, ref_confs, ref_classes = reference.detect([frame], conf=conf, **kwargs)[0]
+        cand_boxes, cand_confs, cand_classes = candidate.detect([frame], conf=conf, **kwargs)[0]
+        total += len(ref_boxes)
+        if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+            extra += len(cand_boxes)
+            continue
+
+        iou = iou_matrix(ref_boxes, cand_boxes)
+        iou = np.where(ref_classes[:, None] == cand_classes[None, :], iou, 0.0)
+        best = iou.argmax(axis=1)
+        best_iou = iou[np.arange(len(ref_boxes)), best]
+        hit = best_iou >= iou_threshold
+
+        matched += int(hit.sum())
+        extra += max(0, len(cand_boxes) - int(hit.sum()))
+        ious.extend(best_iou[hit].tolist())
+        conf_diffs.extend(np.abs(ref_confs[hit] - cand_confs[best[hit]]).tolist())
+
+    return {
+        "reference_boxes": total,
+        "recall": matched / total if total else 1.0,
+        "extra_boxes": extra,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "max_conf_diff": float(np.max(conf_diffs)) if conf_diffs else None
+    }
+
+
+def _time_backend(backend, frames, **kwargs):
+    start = time.perf_counter()
+    for frame in frames:
+        backend.detect([frame], **kwargs)
+    return 1000.0 * (time.perf_counter() - start) / max(len(frames), 1)
+
+
+def main(argv=None):
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Export a YOLO model and verify it against PyTorch")
+    parser.add_argument('weights')
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx')
+    parser.add_argument('--int8', action='store_true')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--video', help="Frames to compare on; random noise frames otherwise")
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    args = parser.parse_args(argv)
+
+    frames = []
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        while len(frames) < args.frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    else:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(args.frames)]
+
+    reference = load_backend(args.weights, 'torch', imgsz=args.imgsz)
+    candidate = load_backend(args.weights, args.backend, imgsz=args.imgsz, int8=args.int8)
+
+    parity = check_parity(reference, candidate, frames, imgsz=args.imgsz)
+    print(f"Parity {candidate.name} vs torch: {parity}")
+    print(f"torch: {_time_backend(reference, frames, imgsz=args.imgsz):.1f} ms/frame, "
+          f"{candidate.name}: {_time_backend(candidate, frames, imgsz=args.imgsz):.1f} ms/frame")
+    return 0 if parity['recall'] >= args.min_recall else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
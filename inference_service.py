@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from detection_planner import results_to_arrays
+from inference_backend import load_backend
+
+# In-process YOLO inference service.
+#
+# Each weight file is loaded once per process no matter how many cameras or
+# scripts use it. Frames submitted from any number of producer threads are
+# coalesced into micro-batches: the worker for a model waits at most
+# `max_wait_ms` after the first queued frame for others to arrive, then runs
+# them through the model in a single call. Callers get their own result back
+# through a Future. Batched CPU inference gets noticeably more frames per
+# core than batch-size-1 calls.
+#
+# Models are loaded through inference_backend, so the same service can run
+# eager PyTorch or an exported (optionally INT8) ONNX/TorchScript graph.
+
+
+class _Request:
+    __slots__ = ("frame", "kwargs", "future")
+
+    def __init__(self, frame, kwargs):
+        self.frame = frame
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class _BatchWorker:
+    def __init__(self, model, max_batch, max_wait_ms):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.frames = 0
+        self._pending = deque()
+        self._producers = {}  # thread id -> last submit time
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, kwargs):
+        request = _Request(frame, kwargs)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Inference service is shut down")
+            self._pending.append(request)
+            self._producers[threading.get_ident()] = time.monotonic()
+            self._cond.notify()
+        return request.future
+
+    def _next_batch(self):
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            # Give other active producers a short window to join this batch.
+            # With a single producer there is nobody to wait for.
+            now = time.monotonic()
+            self._producers = {
+                ident: seen for ident, seen in self._producers.items()
+                if now - seen < 1.0
+            }
+            target = min(self.max_batch, max(1, len(self._producers)))
+            deadline = now + self.max_wait
+            while self._running and len(self._pending) < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Only frames with identical inference options share a batch
+            first = self._pending.popleft()
+            batch = [first]
+            leftover = deque()
+            while self._pending and len(batch) < self.max_batch:
+                request = self._pending.popleft()
+                if request.kwargs == first.kwargs:
+                    batch.append(request)
+                else:
+                    leftover.append(request)
+            leftover.extend(self._pending)
+            self._pending = leftover
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.model(
+                    [r.frame for r in batch], verbose=False, **batch[0].kwargs
+                )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(batch)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+        while self._pending:
+            request = self._pending.popleft()
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_exception(RuntimeError("Inference service is shut down"))
+
+
+class ModelClient:
+    # Drop-in for a YOLO model object at the existing call sites:
+    # `client(frame, verbose=False)` returns a one-element results list just
+    # like `model(frame)` does, and `client.names` is the class-name map.
+    def __init__(self, service, weights):
+        self.service = service
+        self.weights = weights
+        self.model = service.model(weights)
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def submit(self, frame, **kwargs):
+        return self.service.submit(self.weights, frame, **kwargs)
+
+    def __call__(self, frame, **kwargs):
+        return [self.submit(frame, **kwargs).result()]
+
+    def detect(self, frames, **kwargs):
+        # Same interface as InferenceBackend.detect, through the batcher
+        futures = [self.submit(frame, **kwargs) for frame in frames]
+        return [results_to_arrays([future.result()]) for future in futures]
+
+
+class InferenceService:
+    def __init__(self, max_batch=4, max_wait_ms=5, loader=None,
+                 backend='torch', int8=False, imgsz=640, fallback=False):
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.backend = backend
+        if loader is None:
+            def loader(weights):
+                return load_backend(weights, backend, imgsz=imgsz, int8=int8, fallback=fallback)
+        self.loader = loader
+        self._models = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def model(self, weights):
+        # Load each weight file at most once
+        with self._lock:
+            if weights not in self._models:
+                model = self.loader(weights)
+                self._models[weights] = model
+                self._workers[weights] = _BatchWorker(
+                    model, self.max_batch, self.max_wait_ms
+                )
+            return self._models[weights]
+
+    def submit(self, weights, frame, **kwargs):
+        self.model(weights)
+        # verbose only controls logging, so it must not split batches
+        kwargs.pop('verbose', None)
+        return self._workers[weights].submit(frame, kwargs)
+
+    def client(self, weights):
+        return ModelClient(self, weights)
+
+    def stats(self):
+        with self._lock:
+            return {
+                weights: {
+                    "batches": worker.batches,
+                    "frames": worker.frames,
+                    "avg_batch": worker.frames / worker.batches if worker.batches else 0.0
+                }
+                for weights, worker in self._workers.items()
+            }
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+            self._models.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def get_service(**options):
+    # Process-wide service shared by every camera pipeline in this process.
+    # `options` (backend, int8, ...) only apply when it is first created.
+    global _default_service
+    with _default_lock:
+        if _default_service is None:
+            _default_service = InferenceService(**options)
+        return _default_service
@@ -0,0 +1,207 @@
+import time
+
+import cv2
+import numpy as np
+
+# Keyframe detection: run the full detector only every N frames and carry
+# the boxes forward with sparse Lucas-Kanade optical flow in between.
+#
+# N adapts to a latency budget. With the measured cost of a keyframe (YOLO)
+# and of a tracked frame (LK), the amortised per-frame cost of N is
+# (keyframe + (N - 1) * tracked) / N, and the smallest N that fits the
+# budget is used. A keyframe is also forced as soon as the boxes can no
+# longer be tracked confidently.
+
+LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+)
+
+
+class SparseBoxPropagator:
+    def __init__(self, max_corners=15, fb_threshold=1.0):
+        self.max_corners = max_corners
+        self.fb_threshold = fb_threshold  # forward-backward error, pixels
+        self.prev_gray = None
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.points = np.empty((0, 2), dtype=np.float32)
+        self.owners = np.empty(0, dtype=np.int64)
+        self.initial_counts = np.empty(0, dtype=np.int64)
+
+    def reset(self, gray, boxes):
+        # Seed corner features inside every freshly detected box
+        height, width = gray.shape[:2]
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4).copy()
+        points, owners = [], []
+
+        for i, (x1, y1, x2, y2) in enumerate(self.boxes.astype(np.int64)):
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            corners = cv2.goodFeaturesToTrack(
+                gray[y1:y2, x1:x2], maxCorners=self.max_corners,
+                qualityLevel=0.01, minDistance=3
+            )
+            if corners is None:
+                continue
+            corners = corners.reshape(-1, 2) + np.array([x1, y1], dtype=np.float32)
+            points.append(corners)
+            owners.append(np.full(len(corners), i, dtype=np.int64))
+
+        if points:
+            self.points = np.concatenate(points).astype(np.float32)
+            self.owners = np.concatenate(owners)
+        else:
+            self.points = np.empty((0, 2), dtype=np.float32)
+            self.owners = np.empty(0, dtype=np.int64)
+        self.initial_counts = np.bincount(self.owners, minlength=len(self.boxes))
+        self.prev_gray = gray
+
+    def propagate(self, gray):
+        # Shift every box by the median motion of its surviving features.
+        # Returns the moved boxes and a per-box confidence in [0, 1].
+        n = len(self.boxes)
+        if n == 0 or len(self.points) == 0 or self.prev_gray is None:
+            self.prev_gray = gray
+            return self.boxes.copy(), np.zeros(n)
+
+        prev_pts = self.points.reshape(-1, 1, 2)
+        next_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, prev_pts, None, **LK_PARAMS
+        )
+        back_pts, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            gray, self.prev_gray, next_pts, None, **LK_PARAMS
+        )
+        fb_error = np.linalg.norm((back_pts - prev_pts).reshape(-1, 2), axis=1)
+        good = (
+            (status.reshape(-1) == 1)
+            & (back_status.reshape(-1) == 1)
+            & (fb_error < self.fb_threshold)
+        )
+
+        displacement = (next_pts - prev_pts).reshape(-1, 2)
+        owners = self.owners[good]
+        moves = displacement[good]
+        counts = np.bincount(owners, minlength=n)
+        for i in np.flatnonzero(counts):
+            dx, dy = np.median(moves[owners == i], axis=0)
+            self.boxes[i] += (dx, dy, dx, dy)
+
+        height, width = gray.shape[:2]
+        self.boxes[:, [0, 2]] = np.clip(self.boxes[:, [0, 2]], 0, width - 1)
+        self.boxes[:, [1, 3]] = np.clip(self.boxes[:, [1, 3]], 0, height - 1)
+
+        self.points = next_pts.reshape(-1, 2)[good]
+        self.owners = owners
+        self.prev_gray = gray
+        confidence = counts / np.maximum(self.initial_counts, 1)
+        return self.boxes.copy(), confidence
+
+
+class AdaptiveCadence:
+    def __init__(self, budget_ms=1000.0 / 30, min_interval=1, max_interval=6, smoothing=0.2):
+        self.budget_ms = budget_ms
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.keyframe_ms = None
+        self.tracked_ms = None
+        self.interval = min_interval
+
+    def _ema(self, current, sample):
+        if current is None:
+            return sample
+        return self.smoothing * sample + (1 - self.smoothing) * current
+
+    def record(self, is_keyframe, elapsed_ms):
+        if is_keyframe:
+            self.keyframe_ms = self._ema(self.keyframe_ms, elapsed_ms)
+        else:
+            self.tracked_ms = self._ema(self.tracked_ms, elapsed_ms)
+        self.interval = self._choose_interval()
+
+    def _choose_interval(self):
+        if self.keyframe_ms is None or self.keyframe_ms <= self.budget_ms:
+            return self.min_interval
+        if self.tracked_ms is None:
+            # No tracked frame measured yet; try the next step up
+            return min(self.max_interval, self.min_interval + 1)
+        if self.tracked_ms >= self.budget_ms:
+            return self.max_interval
+        # Smallest N with (K + (N - 1) * T) / N <= budget
+        needed = (self.keyframe_ms - self.tracked_ms) / (self.budget_ms - self.tracked_ms)
+        return int(np.clip(np.ceil(needed), self.min_interval, self.max_interval))
+
+
+class KeyframeDetector:
+    # `detect_fn(frame)` runs the real detector and returns (boxes, confs,
+    # classes) arrays; detect() returns the same arrays on every frame
+    def __init__(self, detect_fn, budget_ms=1000.0 / 30, min_interval=1, max_interval=6,
+                 min_confidence=0.5, flow_scale=1.0):
+        self.detect_fn = detect_fn
+        self.min_confidence = min_confidence
+        self.flow_scale = flow_scale
+        self.cadence = AdaptiveCadence(budget_ms, min_interval, max_interval)
+        self.propagator = SparseBoxPropagator()
+        self.frames_since_keyframe = 0
+        self.keyframes = 0
+        self.tracked_frames = 0
+        self._confs = np.empty(0)
+        self._classes = np.empty(0, dtype=np.int32)
+        self._confidence = 0.0
+        self._has_keyframe = False
+
+    def _gray(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.flow_scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.flow_scale, fy=self.flow_scale,
+                              interpolation=cv2.INTER_AREA)
+        return gray
+
+    def needs_keyframe(self):
+        return (
+            not self._has_keyframe
+            or self.frames_since_keyframe + 1 >= self.cadence.interval
+            or self._confidence < self.min_confidence
+        )
+
+    def detect(self, frame):
+        start = time.perf_counter()
+        gray = self._gray(frame)
+        is_keyframe = self.needs_keyframe()
+
+        if is_keyframe:
+            boxes, confs, classes = self.detect_fn(frame)
+            self.propagator.reset(gray, np.asarray(boxes, dtype=np.float32) * self.flow_scale)
+            self._confs, self._classes = confs, classes
+            self._confidence = 1.0
+            self._has_keyframe = True
+            self.frames_since_keyframe = 0
+            self.keyframes += 1
+        else:
+            scaled_boxes, confidence = self.propagator.propagate(gray)
+            boxes = (scaled_boxes / self.flow_scale).astype(np.int32)
+            confs, classes = self._confs, self._classes
+            # Boxes that had no features to seed cannot vouch either way; an
+            # empty scene stays trusted until the next scheduled keyframe
+            trackable = self.propagator.initial_counts > 0
+            if trackable.any():
+                self._confidence = float(confidence[trackable].mean())
+            else:
+                self._confidence = 0.0 if len(confidence) else 1.0
+            self.frames_since_keyframe += 1
+            self.tracked_frames += 1
+
+        self.cadence.record(is_keyframe, 1000.0 * (time.perf_counter() - start))
+        return np.asarray(boxes).astype(np.int32).reshape(-1, 4), confs, classes
+
+    def stats(self):
+        return {
+            "keyframes": self.keyframes,
+            "tracked_frames": self.tracked_frames,
+            "interval": self.cadence.interval,
+            "keyframe_ms": self.cadence.keyframe_ms,
+            "tracked_ms": self.cadence.tracked_ms
+        }
@@ -0,0 +1,171 @@
+import numpy as np
+
+# Per-track kinematic state for tracked vehicles.
+#
+# Every track carries a constant-acceleration Kalman filter on two axes:
+# range (metres ahead, from the monocular box-width distance model) and
+# lateral offset (metres from the optical axis). All tracks live in one set
+# of arrays and are predicted and updated together with batched matrix
+# operations, so the cost per frame does not grow with Python-level work per
+# vehicle. Closing speed is the negative range rate.
+
+RANGE, LATERAL = 0, 1
+
+
+def monocular_range(box_widths, focal_length=1000.0, known_width=2.0):
+    # Pinhole model: an object `known_width` metres wide spans
+    # focal_length * known_width / range pixels
+    return known_width * focal_length / np.maximum(np.asarray(box_widths, dtype=np.float64), 1.0)
+
+
+def _transition(dt):
+    return np.array([
+        [1.0, dt, 0.5 * dt * dt],
+        [0.0, 1.0, dt],
+        [0.0, 0.0, 1.0]
+    ])
+
+
+def _process_noise(dt, jerk_std):
+    # Continuous white-noise jerk model
+    q = jerk_std ** 2
+    return q * np.array([
+        [dt ** 5 / 20, dt ** 4 / 8, dt ** 3 / 6],
+        [dt ** 4 / 8, dt ** 3 / 3, dt ** 2 / 2],
+        [dt ** 3 / 6, dt ** 2 / 2, dt]
+    ])
+
+
+class KinematicStateStore:
+    def __init__(self, focal_length=1000.0, known_width=2.0, image_center_x=640.0,
+                 jerk_std=(4.0, 2.0), range_noise=0.08, lateral_noise=0.2, capacity=32):
+        # range_noise is relative (monocular range error grows with range),
+        # lateral_noise is in metres
+        self.focal_length = focal_length
+        self.known_width = known_width
+        self.image_center_x = image_center_x
+        self.jerk_std = jerk_std
+        self.range_noise = range_noise
+        self.lateral_noise = lateral_noise
+
+        # x: (tracks, axes, [position, velocity, acceleration]); P per axis
+        self.x = np.zeros((capacity, 2, 3))
+        self.P = np.zeros((capacity, 2, 3, 3))
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self._rows = {}
+        self.last_time = None
+
+    def __len__(self):
+        return self.size
+
+    def measure(self, boxes):
+        # (N, 2) range and lateral offset of xyxy boxes, in metres
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        ranges = monocular_range(boxes[:, 2] - boxes[:, 0], self.focal_length, self.known_width)
+        center_x = (boxes[:, 0] + boxes[:, 2]) / 2.0
+        lateral = (center_x - self.image_center_x) * ranges / self.focal_length
+        return np.stack([ranges, lateral], axis=1)
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity)
+        for name in ('x', 'P', 'ids'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _add(self, track_ids, z):
+        n = len(track_ids)
+        self._grow(self.size + n)
+        rows = np.arange(self.size, self.size + n)
+        self.ids[rows] = track_ids
+        self.x[rows] = 0.0
+        self.x[rows, :, 0] = z
+        # Position is as good as one measurement; velocity and acceleration
+        # are unknown until the track has a few frames
+        self.P[rows] = 0.0
+        self.P[rows, RANGE, 0, 0] = (self.range_noise * z[:, RANGE]) ** 2
+        self.P[rows, LATERAL, 0, 0] = self.lateral_noise ** 2
+        self.P[rows, :, 1, 1] = 25.0
+        self.P[rows, :, 2, 2] = 25.0
+        for track_id, row in zip(track_ids.tolist(), rows.tolist()):
+            self._rows[track_id] = row
+        self.size += n
+        return rows
+
+    def predict(self, frame_time):
+        # Advance every track to `frame_time`
+        if self.last_time is None or self.size == 0:
+            self.last_time = frame_time
+            return
+        dt = frame_time - self.last_time
+        self.last_time = frame_time
+        if dt <= 0:
+            return
+
+        F = _transition(dt)
+        x = self.x[:self.size]
+        P = self.P[:self.size]
+        x[:] = x @ F.T
+        P[:] = F @ P @ F.T
+        for axis in (RANGE, LATERAL):
+            P[:, axis] += _process_noise(dt, self.jerk_std[axis])
+
+    def update(self, track_ids, boxes, frame_time):
+        # Predict all tracks to `frame_time`, then correct the ones measured
+        # this frame. New IDs start a track. Returns the rows of `track_ids`.
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        z = self.measure(boxes)
+        self.predict(frame_time)
+
+        rows = np.array([self._rows.get(i, -1) for i in track_ids.tolist()], dtype=np.int64)
+        new = rows < 0
+        if new.any():
+            rows[new] = self._add(track_ids[new], z[new])
+
+        old = np.flatnonzero(~new)
+        if len(old):
+            r = rows[old]
+            noise = np.empty((len(r), 2))
+            noise[:, RANGE] = (self.range_noise * z[old, RANGE]) ** 2
+            noise[:, LATERAL] = self.lateral_noise ** 2
+
+            # Scalar position measurement per axis: H = [1, 0, 0]
+            P = self.P[r]
+            innovation = z[old] - self.x[r, :, 0]
+            S = P[..., 0, 0] + noise
+            K = P[..., :, 0] / S[..., None]
+            self.x[r] += K * innovation[..., None]
+            self.P[r] = P - K[..., :, None] * P[..., None, 0, :]
+
+        return rows
+
+    def forget(self, track_ids):
+        # Drop tracks by swapping the last row into their place
+        for track_id in track_ids:
+            row = self._rows.pop(track_id, None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                self.x[row] = self.x[last]
+                self.P[row] = self.P[last]
+                self.ids[row] = self.ids[last]
+                self._rows[int(self.ids[row])] = row
+            self.size -= 1
+
+    def state(self, rows):
+        # Range, closing speed, range acceleration and lateral offset/speed
+        # of the given rows as a dict of arrays
+        x = self.x[rows]
+        return {
+            'range': x[:, RANGE, 0],
+            'closing_speed': -x[:, RANGE, 1],
+            'range_accel': x[:, RANGE, 2],
+            'lateral': x[:, LATERAL, 0],
+            'lateral_speed': x[:, LATERAL, 1]
+        }
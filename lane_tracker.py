@@ -0,0 +1,293 @@
+import cv2
+import numpy as np
+
+# Temporal lane tracking.
+#
+# The first frame, and any frame after the lane is lost, gets the full
+# search the scripts always did: Canny over the ROI triangle, HoughLinesP and
+# one straight-line fit per side. While the lane is held confidently, the
+# next frame only runs Canny on the rows below the horizon and fits each
+# side to the edge pixels in a narrow band around the previous line. Lanes
+# barely move between frames, so most frames skip Hough and most of the
+# edge work.
+#
+# Edges from vehicles inside a band can pull a band fit away from the
+# paint a few pixels per frame while its edge support stays high, so a band
+# fit is only accepted when it moves at most max_shift pixels from the
+# previous line and at most max_drift pixels from the line the last full
+# search found. Otherwise, and every redetect_interval frames regardless,
+# the frame gets a full search.
+#
+# Lines are x = m * y + b in image pixels and are reported in the scripts'
+# [x_bottom, max_y, x_top, min_y] format. A side's confidence is the share
+# of band rows that have edge support; the lane confidence is their mean.
+
+HOUGH_PARAMS = dict(
+    rho=6,
+    theta=np.pi / 60,
+    threshold=160,
+    minLineLength=40,
+    maxLineGap=25
+)
+
+
+class LaneEstimate:
+    __slots__ = ("left", "right", "confidence", "mode")
+
+    def __init__(self, left, right, confidence, mode):
+        self.left = left
+        self.right = right
+        self.confidence = confidence
+        self.mode = mode  # "full", "prior" or "lost"
+
+    @property
+    def lines(self):
+        # Both sides, or None when either is missing
+        if self.left is None or self.right is None:
+            return None
+        return self.left, self.right
+
+
+class LaneTracker:
+    def __init__(self, band=25, min_confidence=0.2, max_lost=10, smoothing=0.6,
+                 horizon=3 / 5, canny=(100, 200), max_shift=15, max_drift=40,
+                 redetect_interval=30):
+        # band: half-width in pixels of the search band around each prior
+        # line. Below min_confidence the next frame does a full search; after
+        # max_lost frames without a lane the last one is dropped. max_shift
+        # and max_drift (pixels, at the bottom and the horizon) bound an
+        # acceptable band fit; redetect_interval forces a full search every
+        # that many frames (0 disables it).
+        self.band = band
+        self.min_confidence = min_confidence
+        self.max_lost = max_lost
+        self.smoothing = smoothing
+        self.horizon = horizon
+        self.canny = canny
+        self.max_shift = max_shift
+        self.max_drift = max_drift
+        self.redetect_interval = redetect_interval
+        self.reset()
+
+    def reset(self):
+        self.models = [None, None]  # (m, b) for left and right
+        self.anchors = [None, None]  # lines found by the last full search
+        self.side_confidence = [0.0, 0.0]
+        self.lost_frames = 0
+        self.full_searches = 0
+        self.prior_searches = 0
+        self.rejected_fits = 0
+        self.since_full = 0
+
+    @property
+    def confidence(self):
+        return float(np.mean(self.side_confidence))
+
+    @staticmethod
+    def roi_vertices(width, height):
+        return [
+            (0, height),
+            (width / 2, height / 2),
+            (width, height),
+        ]
+
+    def _rows(self, height):
+        return int(height * self.horizon), height
+
+    def _edges(self, image, y0, x0=0, x1=None):
+        gray = cv2.cvtColor(image[y0:, x0:x1], cv2.COLOR_BGR2GRAY)
+        return cv2.Canny(gray, *self.canny)
+
+    @staticmethod
+    def _edge_points(edges, x0, y0):
+        # cv2.findNonZero is several times faster than np.nonzero here
+        points = cv2.findNonZero(edges)
+        if points is None:
+            return np.empty(0), np.empty(0)
+        points = points.reshape(-1, 2)
+        return points[:, 0] + x0, points[:, 1] + y0
+
+    def _fit_band(self, xs, ys, num_rows, model):
+        # Least-squares x = m * y + b over edge pixels within `band` of the
+        # model, refined once on the pixels closest to the first fit
+        if len(ys) == 0:
+            return None, 0.0
+        m, b = model
+        near = np.abs(xs - (m * ys + b)) < self.band
+        if near.sum() < 10:
+            return None, 0.0
+        fit = np.polyfit(ys[near], xs[near], deg=1)
+        close = near & (np.abs(xs - (fit[0] * ys + fit[1])) < self.band / 2)
+        if close.sum() >= 10:
+            fit = np.polyfit(ys[close], xs[close], deg=1)
+            near = close
+        coverage = len(np.unique(ys[near])) / float(num_rows)
+        return (float(fit[0]), float(fit[1])), min(1.0, coverage)
+
+    @staticmethod
+    def _plausible(model, side):
+        # Same slope rules as the Hough split: |dy/dx| >= 0.5, left lines
+        # lean one way and right lines the other. Near-vertical lines
+        # (|dy/dx| > 5) are vehicle sides or poles rather than lane paint.
+        m = model[0]
+        if abs(m) > 2.0 or abs(m) < 0.2:
+            return False
+        return m < 0 if side == 0 else m > 0
+
+    def _near(self, fit, reference, limit, height):
+        # Whether two lines are within `limit` pixels at both the bottom row
+        # and the horizon
+        y0, _ = self._rows(height)
+        return all(
+            abs((fit[0] - reference[0]) * y + fit[1] - reference[1]) <= limit
+            for y in (y0, height - 1)
+        )
+
+    def _consistent(self, fit, side, height):
+        # A band fit must stay near the previous line and near the line the
+        # last full search found
+        for reference, limit in ((self.models[side], self.max_shift),
+                                 (self.anchors[side], self.max_drift)):
+            if reference is not None and not self._near(fit, reference, limit, height):
+                return False
+        return True
+
+    def _full_search(self, image):
+        height, width = image.shape[:2]
+        y0, _ = self._rows(height)
+        edges = self._edges(image, height // 2)
+        mask = np.zeros_like(edges)
+        vertices = np.array(self.roi_vertices(width, height), np.float64)
+        vertices[:, 1] -= height // 2
+        cv2.fillPoly(mask, [vertices.astype(np.int32)], 255)
+        cropped = cv2.bitwise_and(edges, mask)
+
+        lines = cv2.HoughLinesP(cropped, lines=np.array([]), **HOUGH_PARAMS)
+        models = [None, None]
+        if lines is not None:
+            x1, y1, x2, y2 = lines.reshape(-1, 4).astype(np.float64).T
+            y1, y2 = y1 + height // 2, y2 + height // 2
+            dx = x2 - x1
+            slope = np.divide(y2 - y1, dx, out=np.zeros_like(dx), where=dx != 0)
+            steep = np.abs(slope) >= 0.5
+            for side, members in ((0, steep & (slope <= 0)), (1, steep & (slope > 0))):
+                if members.any():
+                    ys = np.concatenate([y1[members], y2[members]])
+                    xs = np.concatenate([x1[members], x2[members]])
+                    fit = np.polyfit(ys, xs, deg=1)
+                    fit = (float(fit[0]), float(fit[1]))
+                    if self._plausible(fit, side):
+                        models[side] = fit
+
+        # Score the fits the same way prior searches are scored
+        xs, ys = self._edge_points(cropped[y0 - height // 2:], 0, y0)
+        confidence = [0.0, 0.0]
+        for side in (0, 1):
+            if models[side] is not None:
+                refined, confidence[side] = self._fit_band(xs, ys, height - y0, models[side])
+                # The refinement may not wander off its Hough seed
+                if (refined is not None and self._plausible(refined, side)
+                        and self._near(refined, models[side], self.max_drift, height)):
+                    models[side] = refined
+        return models, confidence
+
+    def _prior_search(self, image):
+        # Edges are only computed in the bounding box of each side's band.
+        # Also returns whether every tracked side gave an acceptable fit.
+        height, width = image.shape[:2]
+        y0, _ = self._rows(height)
+        models, confidence = [None, None], [0.0, 0.0]
+        consistent = True
+        for side in (0, 1):
+            if self.models[side] is None:
+                continue
+            m, b = self.models[side]
+            ends = (m * y0 + b, m * (height - 1) + b)
+            x0 = int(np.clip(min(ends) - self.band, 0, width))
+            x1 = int(np.clip(max(ends) + self.band + 1, 0, width))
+            if x1 - x0 < 2:
+                continue
+            xs, ys = self._edge_points(self._edges(image, y0, x0, x1), x0, y0)
+            fit, conf = self._fit_band(xs, ys, height - y0, self.models[side])
+            if fit is None or not self._plausible(fit, side):
+                continue
+            if not self._consistent(fit, side, height):
+                self.rejected_fits += 1
+                consistent = False
+                continue
+            models[side], confidence[side] = fit, conf
+        return models, confidence, consistent
+
+    def _line(self, model, height):
+        if model is None:
+            return None
+        min_y, max_y = self._rows(height)
+        m, b = model
+        return [int(m * max_y + b), max_y, int(m * min_y + b), min_y]
+
+    def update(self, image):
+        height = image.shape[0]
+        use_prior = (
+            all(model is not None for model in self.models)
+            and self.confidence >= self.min_confidence
+            and not (self.redetect_interval and self.since_full >= self.redetect_interval)
+        )
+        mode = "full"
+        if use_prior:
+            models, confidence, consistent = self._prior_search(image)
+            mode = "prior"
+            self.prior_searches += 1
+            if not consistent or np.mean(confidence) < self.min_confidence:
+                # Lost the lane around the prior, or something else pulled
+                # the fit; look everywhere this frame
+                mode = "full"
+        if mode == "full":
+            models, confidence = self._full_search(image)
+            self.full_searches += 1
+            self.since_full = 0
+        else:
+            self.since_full += 1
+
+        found = False
+        for side in (0, 1):
+            if models[side] is None:
+                # Hold the old line a few frames with fading confidence
+                self.side_confidence[side] *= 0.5
+                continue
+            found = True
+            prior = self.models[side]
+            if prior is not None and mode == "prior":
+                a = self.smoothing
+                models[side] = (
+                    a * models[side][0] + (1 - a) * prior[0],
+                    a * models[side][1] + (1 - a) * prior[1]
+                )
+            self.models[side] = models[side]
+            self.side_confidence[side] = confidence[side]
+            if mode == "full":
+                self.anchors[side] = models[side]
+
+        if found:
+            self.lost_frames = 0
+        else:
+            self.lost_frames += 1
+            mode = "lost"
+            if self.lost_frames > self.max_lost:
+                self.models = [None, None]
+                self.anchors = [None, None]
+                self.side_confidence = [0.0, 0.0]
+
+        return LaneEstimate(
+            self._line(self.models[0], height),
+            self._line(self.models[1], height),
+            self.confidence,
+            mode
+        )
+
+    def stats(self):
+        return {
+            "full_searches": self.full_searches,
+            "prior_searches": self.prior_searches,
+            "rejected_fits": self.rejected_fits,
+            "confidence": self.confidence
+        }
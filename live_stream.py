@@ -0,0 +1,79 @@
+import threading
+import time
+
+# Live MJPEG view of the recorder camera for any number of HTTP clients.
+#
+# The FrameEncoder already JPEG-encodes every captured frame for the black
+# box, so the live view reuses those bytes: the encoder publishes each
+# EncodedFrame to a FrameBroadcaster, which only keeps the latest one and
+# wakes the waiting clients. Each client (one generator per HTTP response)
+# always sends the newest frame; frames published while it was still busy
+# writing the previous one are skipped, so a slow client only drops frames
+# for itself and never holds up capture, encoding or the other clients.
+
+BOUNDARY = "frame"
+
+
+class FrameBroadcaster:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self.clients = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def publish(self, frame):
+        # Called by the encoder thread; only swaps a reference and notifies
+        with self._cond:
+            self._latest = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def wait(self, after, timeout=None):
+        # (seq, frame) of the newest frame newer than `after`, or (after,
+        # None) when none arrived within `timeout` seconds
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            return self._seq, self._latest
+
+    def _count(self, sent=0, dropped=0, clients=0):
+        with self._cond:
+            self.sent += sent
+            self.dropped += dropped
+            self.clients += clients
+
+    def stats(self):
+        with self._cond:
+            return {
+                "clients": self.clients,
+                "published": self._seq,
+                "sent": self.sent,
+                "dropped": self.dropped
+            }
+
+
+def mjpeg_stream(broadcaster, max_fps=None, idle_timeout=10.0):
+    # multipart/x-mixed-replace body for one client. max_fps caps this
+    # client's rate (e.g. for a thumbnail); the stream ends after
+    # idle_timeout seconds without a new frame, e.g. once recording stops.
+    period = 1.0 / max_fps if max_fps else 0.0
+    header = f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: ".encode()
+    broadcaster._count(clients=1)
+    seq = broadcaster.wait(0, 0)[0]  # Start from the next frame
+    try:
+        while True:
+            new_seq, frame = broadcaster.wait(seq, idle_timeout)
+            if frame is None:
+                break
+            if seq:
+                broadcaster._count(dropped=new_seq - seq - 1)
+            seq = new_seq
+            sent_at = time.monotonic()
+            yield header + str(len(frame.data)).encode() + b"\r\n\r\n" + bytes(frame.data) + b"\r\n"
+            broadcaster._count(sent=1)
+            if period:
+                time.sleep(max(0.0, period - (time.monotonic() - sent_at)))
+    finally:
+        broadcaster._count(clients=-1)
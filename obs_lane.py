@@ -2,8 +2,9 @@
 Blue Boxes (255, 0, 0): These show all objects detected by the world model (the YOLOv8s-world model). These are being drawn primarily for debugging purposes so you can see what the world model is detecting.
 Red Boxes (0, 0, 255): These indicate objects that meet TWO conditions:
 
-The object is detected within the lane boundaries (using the is_in_lane() function)
-The object overlaps with a detection from the world model
+The object is detected within the lane boundaries
+The object overlaps with a detection from the world model (the world model only
+runs on crops around in-lane candidates, see obstacle_cascade.py)
 This essentially shows potentially hazardous objects that are both in your lane and detected as obstacles.
 
 
@@ -15,178 +16,108 @@ Don't overlap with world model detections
 
 import cv2
 import numpy as np
-import math
 import time
-import torch
-from ultralytics import YOLO
+from inference_service import get_service
+from detection_planner import DetectionInputPlanner
+from frame_pool import FramePool
+from geometry import boxes_in_polygon, lane_polygon
+from lane_tracker import LaneTracker
+from obstacle_cascade import ObstacleCascade
 
-def region_of_interest(img, vertices):
-    mask = np.zeros_like(img)
-    cv2.fillPoly(mask, np.array([vertices], np.int32), 255)
-    return cv2.bitwise_and(img, mask)
+# Reused resize and blend buffers; only the main loop draws, so one pool
+frame_pool = FramePool()
 
 def draw_lane_lines(img, left_line, right_line, color=[0, 255, 0], thickness=10):
-    line_img = np.zeros_like(img)
-    poly_pts = np.array([[
-        (left_line[0], left_line[1]),
-        (left_line[2], left_line[3]),
-        (right_line[2], right_line[3]),
-        (right_line[0], right_line[1])
-    ]], dtype=np.int32)
-    
-    cv2.fillPoly(line_img, poly_pts, color)
-    return cv2.addWeighted(img, 0.8, line_img, 0.5, 0.0)
-
-def pipeline(image):
-    height, width = image.shape[:2]
-    roi_vertices = [
-        (0, height),
-        (width / 2, height / 2),
-        (width, height),
-    ]
-    
-    gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-    cannyed_image = cv2.Canny(gray_image, 100, 200)
-    cropped_image = region_of_interest(cannyed_image, roi_vertices)
-    
-    lines = cv2.HoughLinesP(
-        cropped_image,
-        rho=6,
-        theta=np.pi / 60,
-        threshold=160,
-        lines=np.array([]),
-        minLineLength=40,
-        maxLineGap=25
-    )
-    
-    left_line_x, left_line_y = [], []
-    right_line_x, right_line_y = [], []
-    
-    if lines is None:
-        return image, roi_vertices
-
-    for line in lines:
-        for x1, y1, x2, y2 in line:
-            slope = (y2 - y1) / (x2 - x1) if (x2 - x1) != 0 else 0
-            if abs(slope) < 0.5:
-                continue
-            if slope <= 0:
-                left_line_x.extend([x1, x2])
-                left_line_y.extend([y1, y2])
-            else:
-                right_line_x.extend([x1, x2])
-                right_line_y.extend([y1, y2])
-    
-    min_y, max_y = int(height * (3 / 5)), height
-    
-    left_x_start = left_x_end = right_x_start = right_x_end = 0
-    if left_line_x and left_line_y:
-        poly_left = np.poly1d(np.polyfit(left_line_y, left_line_x, deg=1))
-        left_x_start, left_x_end = int(poly_left(max_y)), int(poly_left(min_y))
-    if right_line_x and right_line_y:
-        poly_right = np.poly1d(np.polyfit(right_line_y, right_line_x, deg=1))
-        right_x_start, right_x_end = int(poly_right(max_y)), int(poly_right(min_y))
-    
-    lane_frame = draw_lane_lines(
-        image,
-        [left_x_start, max_y, left_x_end, min_y],
-        [right_x_start, max_y, right_x_end, min_y]
-    )
-    
-    return lane_frame, roi_vertices
+    # Tints the lane polygon in place, touching only its bounding box
+    return frame_pool.blend_polygon(img, lane_polygon(left_line, right_line), color, 0.8, 0.5)
 
 def is_in_lane(box_coords, roi_vertices):
-    x1, y1, x2, y2 = box_coords
-    box_bottom_center = ((x1 + x2) // 2, y2)
-    
-    roi_vertices = np.array(roi_vertices, np.int32)
-    point = np.array(box_bottom_center)
-    
-    return cv2.pointPolygonTest(roi_vertices, (float(point[0]), float(point[1])), False) >= 0
+    # Bottom center of the box inside the ROI; pass an (N, 4) array to test
+    # every box of a frame with one lookup in the cached ROI mask
+    in_lane = boxes_in_polygon(box_coords, roi_vertices)
+    return bool(in_lane[0]) if np.ndim(box_coords) == 1 else in_lane
 
 def process_webcam():
-    # Load both models
-    lane_model = YOLO('yolov8n.pt')  # Changed path to default
-    world_model = YOLO('/models/yolov8s-world.pt')  # Make sure this path is correct
+    # Load both models once through the shared inference service
+    service = get_service()
+    lane_model = service.client('yolov8n.pt')  # Changed path to default
+    world_model = service.client('/models/yolov8s-world.pt')  # Make sure this path is correct
+    
+    # The lane model only sees the lane ROI crop, at its own inference size
+    lane_planner = DetectionInputPlanner()
+    
+    # The world model only confirms in-lane candidates: "crops" runs it on
+    # crops around in-lane tracks, "cadence" on the ROI every few frames.
+    # Answers are cached per track and refreshed every REFRESH_INTERVAL frames.
+    CASCADE_MODE = "crops"
+    REFRESH_INTERVAL = 10
+    cascade = ObstacleCascade(world_model, mode=CASCADE_MODE, refresh_interval=REFRESH_INTERVAL)
     
-    # Check CUDA availability
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    world_model.to(device)
-    lane_model.to(device)
+    lane_tracker = LaneTracker()
     
     cap = cv2.VideoCapture(1)  # Try 0 first, if not working try 1
     if not cap.isOpened():
         print("Error: Unable to access webcam.")
         return
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Resize frame
-        resized_frame = cv2.resize(frame, (1280, 720))
-        
-        # Get lane detection
-        lane_frame, roi_vertices = pipeline(resized_frame.copy())
-        
-        # Run world model detection first
-        world_boxes = []
-        world_results = world_model(resized_frame, verbose=False)
-        
-        # Store world model detections
-        for result in world_results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                world_boxes.append((x1, y1, x2, y2))
-                # Draw world model detections in blue for debugging
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            
+            # Resize frame into the same buffer every frame
+            resized_frame = frame_pool.resize(frame, (1280, 720), name='resized')
+            
+            # Start the world model on this frame's candidates first, so it
+            # runs while the lanes and the lane model are computed
+            roi_vertices = LaneTracker.roi_vertices(1280, 720)
+            cascade.submit(resized_frame, roi_vertices)
+            
+            # Get lane detection
+            lane = lane_tracker.update(resized_frame)
+            
+            # Run lane model detection
+            boxes, confs, classes = lane_planner.detect(lane_model, resized_frame, roi_vertices)
+            detections, world_boxes = cascade.update(boxes, confs, classes, roi_vertices)
+            
+            # Both models are done with the frame, so it is drawn on directly
+            lane_frame = resized_frame
+            if lane.lines is not None:
+                draw_lane_lines(lane_frame, *lane.lines)
+            
+            # Draw world model detections in blue for debugging
+            for x1, y1, x2, y2 in world_boxes.astype(int).tolist():
                 cv2.rectangle(lane_frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
-        
-        # Run lane model detection
-        lane_results = lane_model(resized_frame, verbose=False)
-        
-        # Process lane model detections
-        for result in lane_results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
-                
-                if conf < 0.5:  # Skip low confidence detections
-                    continue
-                
-                # Check if object is in lane
-                in_lane = is_in_lane((x1, y1, x2, y2), roi_vertices)
-                
-                # Check overlap with world detections
-                is_overlapping = any(
-                    x1 < wb[2] and x2 > wb[0] and y1 < wb[3] and y2 > wb[1]
-                    for wb in world_boxes
-                )
+            
+            # Process lane model detections (low confidence ones are dropped
+            # by the cascade)
+            for detection in detections:
+                x1, y1, x2, y2 = detection['box']
                 
                 # Determine color based on conditions
-                if in_lane and is_overlapping:
-                    color = (0, 0, 255)  # Red for overlap in lane
+                if detection['confirmed']:
+                    color = (0, 0, 255)  # Red for confirmed obstacle in lane
                 else:
                     color = (0, 255, 0)  # Green for other detections
                 
                 # Draw bounding box and label
                 cv2.rectangle(lane_frame, (x1, y1), (x2, y2), color, 2)
-                label = f'{lane_model.names[cls]} {conf:.2f}'
+                label = f"{lane_model.names[detection['cls']]} {detection['conf']:.2f}"
                 cv2.putText(lane_frame, label, (x1, y1 - 10),
                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-        
-        # Show the frame
-        cv2.imshow('Combined Detection System', lane_frame)
-        
-        # Break the loop if 'q' is pressed
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
+            
+            # Show the frame
+            cv2.imshow('Combined Detection System', lane_frame)
+            
+            # Break the loop if 'q' is pressed
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        print(f"Cascade stats: {cascade.stats()}")
+        cascade.close()
+        cap.release()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     process_webcam()
\ No newline at end of file
@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from detection_planner import DetectionInputPlanner, results_to_arrays
+from geometry import as_boxes, boxes_in_polygon, overlap_matrix
+from tracker import MultiObjectTracker
+
+# Cascaded obstacle confirmation for obs_lane.
+#
+# The open-vocabulary world model is several times heavier than the lane
+# model and is only used to confirm lane-model detections inside the lane,
+# so it should not look at every pixel of every frame. The lane-model boxes
+# are tracked, and confirmation is cached per track:
+#
+#   "crops"   the world model runs on padded crops around in-lane tracks
+#             whose cached answer is missing or older than
+#             `refresh_interval` frames, at most `max_crops` per frame
+#   "cadence" the world model runs on the lane ROI crop every
+#             `refresh_interval` frames and tracks are confirmed against
+#             its latest boxes (refresh_interval=1 is the old behaviour)
+#
+# World-model work for a frame is started from the tracks' last known boxes
+# in submit(), before the lane model runs, and runs on a worker thread (and
+# through the inference service's batcher when the model supports it), so
+# the two models overlap. Its answers are collected in update().
+
+MODES = ("crops", "cadence")
+
+
+class ObstacleCascade:
+    def __init__(self, world_model, mode="crops", refresh_interval=10, crop_padding=0.25,
+                 crop_imgsz=320, max_crops=4, conf_threshold=0.5, tracker=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cascade mode: {mode}")
+        self.world_model = world_model
+        self.mode = mode
+        self.refresh_interval = refresh_interval
+        self.crop_padding = crop_padding
+        self.crop_imgsz = crop_imgsz
+        self.max_crops = max_crops
+        self.conf_threshold = conf_threshold
+        self.tracker = tracker or MultiObjectTracker()
+        self.planner = DetectionInputPlanner()
+
+        self.frame_index = 0
+        self.cache = {}  # track id -> (confirmed, frame checked)
+        self.world_boxes = np.empty((0, 4), dtype=np.float32)
+        self.world_runs = 0
+        self.world_crops = 0
+        self._pending = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _run_world(self, frames, **kwargs):
+        # One results list per frame; through the service's batcher if the
+        # model is an inference-service client
+        submit = getattr(self.world_model, 'submit', None)
+        if submit is not None:
+            futures = [submit(frame, **kwargs) for frame in frames]
+            return [[future.result()] for future in futures]
+        return [[result] for result in self.world_model(frames, verbose=False, **kwargs)]
+
+    def _crop_job(self, frame, track_ids, crop_boxes):
+        offsets = crop_boxes[:, :2]
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in crop_boxes.tolist()]
+        results = self._run_world(crops, imgsz=self.crop_imgsz)
+        world = []
+        for results_i, (ox, oy) in zip(results, offsets.tolist()):
+            boxes, _, _ = results_to_arrays(results_i)
+            world.append(boxes + np.array([ox, oy, ox, oy], dtype=np.float32))
+        return 'crops', track_ids, world
+
+    def _roi_job(self, frame, roi_vertices):
+        boxes, _, _ = self.planner.detect(self.world_model, frame, roi_vertices)
+        return 'cadence', None, boxes
+
+    def _crop_boxes(self, boxes, shape):
+        height, width = shape[:2]
+        boxes = as_boxes(boxes)
+        pad_x = (boxes[:, 2] - boxes[:, 0]) * self.crop_padding
+        pad_y = (boxes[:, 3] - boxes[:, 1]) * self.crop_padding
+        crops = np.stack([
+            boxes[:, 0] - pad_x, boxes[:, 1] - pad_y,
+            boxes[:, 2] + pad_x, boxes[:, 3] + pad_y
+        ], axis=1)
+        crops[:, [0, 2]] = np.clip(crops[:, [0, 2]], 0, width)
+        crops[:, [1, 3]] = np.clip(crops[:, [1, 3]], 0, height)
+        crops = crops.astype(np.int32)
+        valid = ((crops[:, 2] - crops[:, 0]) > 8) & ((crops[:, 3] - crops[:, 1]) > 8)
+        return crops, valid
+
+    def submit(self, frame, roi_vertices):
+        # Start this frame's world-model work from the tracks' last boxes;
+        # call before running the lane model on the same frame
+        self.frame_index += 1
+        if self.mode == "cadence":
+            if (self.frame_index - 1) % self.refresh_interval == 0:
+                self._pending = self._executor.submit(self._roi_job, frame, roi_vertices)
+            return
+
+        tracks = self.tracker.tracks
+        if not tracks:
+            return
+        last_boxes = as_boxes([t.bbox for t in tracks])
+        in_lane = boxes_in_polygon(last_boxes, roi_vertices)
+        age = np.array([
+            self.frame_index - self.cache[t.id][1] if t.id in self.cache else np.inf
+            for t in tracks
+        ])
+        stale = in_lane & (age >= self.refresh_interval)
+        # Never-checked tracks first, then the oldest answers
+        candidates = np.flatnonzero(stale)
+        candidates = candidates[np.argsort(-age[candidates], kind='stable')][:self.max_crops]
+        if len(candidates) == 0:
+            return
+
+        crop_boxes, valid = self._crop_boxes(last_boxes[candidates], frame.shape)
+        candidates, crop_boxes = candidates[valid], crop_boxes[valid]
+        if len(candidates) == 0:
+            return
+        track_ids = [tracks[i].id for i in candidates.tolist()]
+        self.world_crops += len(track_ids)
+        self._pending = self._executor.submit(self._crop_job, frame, track_ids, crop_boxes)
+
+    def _collect(self):
+        if self._pending is None:
+            return None
+        job = self._pending.result()
+        self._pending = None
+        self.world_runs += 1
+        return job
+
+    def update(self, boxes, confs, classes, roi_vertices):
+        # Lane-model detections of the frame passed to submit(). Returns one
+        # dict per kept detection (box, conf, cls, id, in_lane, confirmed)
+        # and the world-model boxes produced for this frame.
+        boxes = as_boxes(boxes)
+        keep = np.asarray(confs) >= self.conf_threshold
+        boxes, confs, classes = boxes[keep], np.asarray(confs)[keep], np.asarray(classes)[keep]
+
+        track_ids = self.tracker.update(boxes, classes).tolist()
+        for track_id in self.tracker.expired_ids:
+            self.cache.pop(track_id, None)
+        in_lane = boxes_in_polygon(boxes, roi_vertices)
+
+        world_boxes = self.world_boxes if self.mode == "cadence" else np.empty((0, 4))
+        job = self._collect()
+        if job is not None:
+            mode, job_ids, world = job
+            if mode == "cadence":
+                # Every track is re-confirmed against the new boxes below
+                self.world_boxes = world_boxes = world
+                self.cache.clear()
+            else:
+                index = {track_id: i for i, track_id in enumerate(track_ids)}
+                for track_id, crop_world in zip(job_ids, world):
+                    i = index.get(track_id)
+                    if i is None:
+                        continue  # not seen this frame; checked again later
+                    confirmed = bool(overlap_matrix(boxes[i], crop_world).any())
+                    self.cache[track_id] = (confirmed, self.frame_index)
+                world_boxes = np.concatenate(world)
+
+        if self.mode == "cadence":
+            # Unchecked in-lane tracks (all of them after a refresh) against
+            # the latest world boxes, as one overlap matrix
+            missing = [i for i in np.flatnonzero(in_lane).tolist() if track_ids[i] not in self.cache]
+            if missing:
+                confirmed = overlap_matrix(boxes[missing], self.world_boxes).any(axis=1)
+                for i, is_confirmed in zip(missing, confirmed.tolist()):
+                    self.cache[track_ids[i]] = (is_confirmed, self.frame_index)
+
+        detections = []
+        for i, track_id in enumerate(track_ids):
+            entry = self.cache.get(track_id)
+            detections.append({
+                'id': track_id,
+                'box': boxes[i].astype(int).tolist(),
+                'conf': float(confs[i]),
+                'cls': int(classes[i]),
+                'in_lane': bool(in_lane[i]),
+                'confirmed': bool(in_lane[i]) and entry is not None and entry[0]
+            })
+        return detections, world_boxes
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "frames": self.frame_index,
+            "world_runs": self.world_runs,
+            "world_crops": self.world_crops,
+            "cached_tracks": len(self.cache)
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from association import associate
+
+# Chunk-parallel offline processing of recorded ride videos.
+#
+# Each video (or every video in a directory) is split into frame-range
+# chunks that run in a process pool, one model per worker process. A chunk
+# starts `overlap` frames early: those warm-up frames prime the optical flow,
+# the speed smoothing and the ID association, and are dropped from its
+# output. Because the warm-up frames are the last frames of the previous
+# chunk, they are also where the chunks' object IDs are stitched together,
+# so the merged telemetry reads like one sequential run.
+#
+#   python offline_batch.py videos/ --output telemetry/ --workers 8
+#
+# Writes one JSON-lines file per video in the speed_final telemetry format.
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+_worker = {}
+
+
+def find_videos(paths):
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(os.path.join(path, name))
+        else:
+            videos.append(path)
+    return videos
+
+
+def video_info(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video {path}")
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    return num_frames, fps
+
+
+def plan_chunks(num_frames, chunk_frames, overlap):
+    # (warm_start, start, end) frame ranges; frames [warm_start, start) only
+    # warm the chunk up. Unknown lengths are processed as one chunk. At least
+    # one warm-up frame is needed to seed the optical flow.
+    if num_frames <= 0:
+        return [(0, 0, None)]
+    overlap = max(1, overlap)
+    chunks = []
+    for start in range(0, num_frames, chunk_frames):
+        end = min(num_frames, start + chunk_frames)
+        chunks.append((max(0, start - overlap), start, end))
+    return chunks
+
+
+def _init_worker(weights, backend, int8, threads):
+    # One model per process; OpenCV threads are capped so the pool does not
+    # oversubscribe the cores
+    from inference_backend import load_backend
+    cv2.setNumThreads(threads)
+    _worker['model'] = load_backend(weights, backend, int8=int8)
+
+
+def _seek(cap, frame_index):
+    if frame_index == 0:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    # Some containers seek to the previous keyframe; read up to the target
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    while position < frame_index:
+        if not cap.grab():
+            break
+        position += 1
+
+
+def process_chunk(video, chunk_index, warm_start, start, end, fps):
+    # Runs in a worker: speed_final over frames [warm_start, end) with
+    # chunk-local IDs. Returns the records of every frame, warm-up included.
+    import speed_final
+
+    model = _worker['model']
+    cap = cv2.VideoCapture(video)
+    _seek(cap, warm_start)
+
+    records = []
+    estimator = None
+    index = warm_start
+    try:
+        while end is None or index < end:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if estimator is None:
+                # The first frame only seeds the optical flow, as in main()
+                estimator = speed_final.SpeedEstimator(fps)
+                estimator.start(frame)
+            else:
+                boxes = speed_final.detect_boxes(model, frame)
+                estimates = estimator.process(frame, boxes, keep_flow=False)
+                records.append(speed_final.frame_record(index, index / fps, estimates))
+            index += 1
+    finally:
+        cap.release()
+    return video, chunk_index, start, records
+
+
+def _bottom_centers(record):
+    boxes = np.array([obj['box'] for obj in record['obj']], dtype=np.float64).reshape(-1, 4)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+
+
+def merge_chunks(chunks, match_distance=4.0):
+    # `chunks` is a list of (start, records) in video order. Chunk-local IDs
+    # are mapped to global ones by matching the boxes of the warm-up frames
+    # against the same frames of the previous chunk, latest frame first.
+    merged = []
+    next_id = 1
+    previous = {}  # frame index -> merged record of the previous chunk
+
+    for start, records in chunks:
+        mapping = {}
+        used = set()
+        for record in reversed([r for r in records if r['i'] < start]):
+            prev_record = previous.get(record['i'])
+            if prev_record is None or not record['obj'] or not prev_record['obj']:
+                continue
+            matches = associate(
+                _bottom_centers(record), _bottom_centers(prev_record), match_distance
+            )
+            for obj, match in zip(record['obj'], matches.tolist()):
+                if match < 0 or obj['id'] in mapping:
+                    continue
+                global_id = prev_record['obj'][match]['id']
+                if global_id not in used:
+                    mapping[obj['id']] = global_id
+                    used.add(global_id)
+
+        previous = {}
+        for record in records:
+            if record['i'] < start:
+                continue
+            for obj in record['obj']:
+                if obj['id'] not in mapping:
+                    mapping[obj['id']] = next_id
+                    next_id += 1
+                obj['id'] = mapping[obj['id']]
+            merged.append(record)
+            previous[record['i']] = record
+
+    return merged
+
+
+def write_records(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')))
+            f.write('\n')
+
+
+def run_batch(videos, output_dir, weights, workers=None, chunk_frames=900, overlap=15,
+              backend='torch', int8=False, threads_per_worker=1):
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for video in videos:
+        num_frames, fps = video_info(video)
+        for chunk_index, (warm_start, start, end) in enumerate(
+                plan_chunks(num_frames, chunk_frames, overlap)):
+            jobs.append((video, chunk_index, warm_start, start, end, fps))
+
+    results = {video: {} for video in videos}
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(weights, backend, int8, threads_per_worker)) as pool:
+        futures = [pool.submit(process_chunk, *job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            video, chunk_index, start, records = future.result()
+            results[video][chunk_index] = (start, records)
+            print(f"[{done}/{len(jobs)}] {os.path.basename(video)} chunk {chunk_index}")
+
+    outputs = {}
+    for video in videos:
+        chunks = [results[video][i] for i in sorted(results[video])]
+        stem = os.path.splitext(os.path.basename(video))[0]
+        path = os.path.join(output_dir, f"{stem}.jsonl")
+        write_records(path, merge_chunks(chunks))
+        outputs[video] = path
+    return outputs
+
+
+def main(argv=None):
+    import speed_final
+
+    parser = argparse.ArgumentParser(description="Chunk-parallel offline speed estimation")
+    parser.add_argument('inputs', nargs='+', help="Video files and/or directories of videos")
+    parser.add_argument('--output', default='telemetry', help="Directory for the merged records")
+    parser.add_argument('--weights', default=speed_final.MODEL_PATH)
+    parser.add_argument('--backend', choices=('torch', 'onnx', 'torchscript'), default='torch')
+    parser.add_argument('--int8', action='store_true')
+    parser.add_argument('--workers', type=int, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-frames', type=int, default=900)
+    parser.add_argument('--overlap', type=int, default=15,
+                        help="Warm-up frames replayed before every chunk")
+    args = parser.parse_args(argv)
+
+    videos = find_videos(args.inputs)
+    if not videos:
+        print("No videos found")
+        return 1
+
+    start = time.perf_counter()
+    outputs = run_batch(
+        videos, args.output, args.weights, args.workers, args.chunk_frames,
+        args.overlap, args.backend, args.int8
+    )
+    for video, path in outputs.items():
+        print(f"{video} -> {path}")
+    print(f"Processed {len(videos)} video(s) in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from blackbox import EncodedFrame
+
+# Crash-safe, memory-mapped black-box ring file.
+#
+# Stores the recorder's encoded frames in a fixed-size file instead of the
+# Python heap, so memory use is constant and the footage survives the
+# process (or the board) dying in the crash it was recording. Layout:
+#
+#   header   magic, version, slot count, data capacity
+#   index    one slot per frame: sequence number, log position, length,
+#            capture timestamp, raw size and CRC32 of the encoded bytes
+#   data     circular area holding the JPEG bytes back to back
+#
+# Frame positions are offsets in an ever-growing logical log; a frame lives
+# at log position % capacity and never wraps around the end of the data
+# area, so it can be read as one slice of the map without copying. A frame
+# is valid while it is among the last `capacity` bytes of the log. Snapshots
+# are zero-copy views, read (e.g. exported) right away; only the frames the
+# writer is about to overwrite are copied out, so a snapshot costs a few MB
+# at most instead of the whole ring. The data
+# is written before its index slot, and the slot's sequence number is
+# written last, so after a crash recover() trusts exactly the slots whose
+# CRC matches their bytes.
+
+MAGIC = b"BBOXRING"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQ")
+HEADER_SIZE = 64
+INDEX_DTYPE = np.dtype([
+    ("seq", "<u8"),        # 0 = empty slot
+    ("position", "<u8"),   # logical log position of the first byte
+    ("timestamp", "<f8"),
+    ("length", "<u4"),
+    ("raw_bytes", "<u4"),
+    ("crc", "<u4"),
+    ("_pad", "<u4")
+])
+
+
+class MappedFrame:
+    # One frame of the ring; `data` is a zero-copy view into the map. A
+    # frame can be overwritten once the writer has moved `capacity` bytes
+    # past it, in which case decode() returns None.
+    __slots__ = ("ring", "seq", "timestamp", "position", "length", "raw_bytes")
+
+    def __init__(self, ring, seq, timestamp, position, length, raw_bytes):
+        self.ring = ring
+        self.seq = seq
+        self.timestamp = timestamp
+        self.position = position
+        self.length = length
+        self.raw_bytes = raw_bytes
+
+    @property
+    def data(self):
+        return self.ring._view(self.position, self.length)
+
+    def valid(self):
+        return self.ring._holds(self.position)
+
+    def decode(self):
+        if not self.valid():
+            return None
+        frame = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        # The writer may have lapped the frame while it was being decoded
+        return frame if self.valid() else None
+
+
+class MappedFrameRing:
+    def __init__(self, path, capacity=48 * 1024 * 1024, max_frames=4096, flush_interval=1.0,
+                 copy_margin=None):
+        # Opens `path`, creating (or re-creating, if its geometry differs) a
+        # ring of `capacity` data bytes and `max_frames` index slots. Frames
+        # already in a compatible file are kept. flush_interval: seconds
+        # between msync calls, which bound what a power loss can take.
+        # copy_margin: snapshot() copies the frames within this many bytes of
+        # being overwritten (default capacity / 16, ~2 s of the default ring).
+        self.path = path
+        self.flush_interval = flush_interval
+        self.copy_margin = capacity // 16 if copy_margin is None else copy_margin
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.evicted = 0
+
+        index_bytes = max_frames * INDEX_DTYPE.itemsize
+        self._data_offset = HEADER_SIZE + index_bytes
+        size = self._data_offset + capacity
+
+        existing = os.path.exists(path) and os.path.getsize(path) == size
+        if existing:
+            with open(path, "rb") as f:
+                magic, version, slots, data_capacity = _HEADER.unpack(f.read(_HEADER.size))
+            existing = (magic, version, slots, data_capacity) == (MAGIC, VERSION, max_frames, capacity)
+
+        if not existing:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "wb") as f:
+                f.truncate(size)
+                f.write(_HEADER.pack(MAGIC, VERSION, max_frames, capacity))
+
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.capacity = capacity
+        self.max_frames = max_frames
+        self._index = np.ndarray((max_frames,), dtype=INDEX_DTYPE, buffer=self._map, offset=HEADER_SIZE)
+        self._recover()
+
+    @classmethod
+    def open(cls, path, flush_interval=1.0):
+        # Open an existing ring with the geometry stored in its header
+        with open(path, "rb") as f:
+            magic, version, slots, capacity = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a black-box ring file")
+        return cls(path, capacity, slots, flush_interval)
+
+    def _recover(self):
+        # Rebuild the write state from the slots that survived intact
+        index = self._index
+        used = np.flatnonzero(index["seq"] > 0)
+        valid = []
+        for slot in used[np.argsort(index["seq"][used])].tolist():
+            entry = index[slot]
+            position, length = int(entry["position"]), int(entry["length"])
+            offset = position % self.capacity
+            if offset + length > self.capacity:
+                index[slot]["seq"] = 0
+                continue
+            crc = zlib.crc32(self._view(position, length))
+            if crc != int(entry["crc"]):
+                index[slot]["seq"] = 0  # torn write
+                continue
+            valid.append(slot)
+
+        if valid:
+            last = index[valid[-1]]
+            self._end = int(last["position"]) + int(last["length"])
+            self._next_seq = int(last["seq"]) + 1
+        else:
+            self._end = 0
+            self._next_seq = 1
+        # Drop slots the log has already moved past
+        for slot in valid:
+            if not self._holds(int(index[slot]["position"])):
+                index[slot]["seq"] = 0
+        live = self._live_slots()
+        self._oldest = int(index["seq"][live].min()) if len(live) else self._next_seq
+
+    def _live_slots(self):
+        return np.flatnonzero(self._index["seq"] > 0)
+
+    def _view(self, position, length):
+        offset = self._data_offset + position % self.capacity
+        return memoryview(self._map)[offset:offset + length]
+
+    def _holds(self, position):
+        return position >= self._end - self.capacity
+
+    def __len__(self):
+        with self._lock:
+            return len(self._live_slots())
+
+    def append(self, frame):
+        # Store an EncodedFrame (anything with timestamp, data, raw_bytes)
+        data = frame.data
+        length = len(data)
+        if length > self.capacity:
+            return
+        with self._lock:
+            position = self._end
+            if position % self.capacity + length > self.capacity:
+                # Never split a frame over the end; skip to the next lap
+                position += self.capacity - position % self.capacity
+            self._end = position + length
+
+            # Evict the oldest frames until the survivors neither overlap
+            # the new bytes nor hold the index slot the new frame takes
+            index = self._index
+            seq = self._next_seq
+            while self._oldest < seq:
+                entry = index[self._oldest % self.max_frames]
+                if entry["seq"] == self._oldest:
+                    if self._holds(int(entry["position"])) and self._oldest > seq - self.max_frames:
+                        break
+                    entry["seq"] = 0
+                    self.evicted += 1
+                self._oldest += 1
+
+            slot = index[seq % self.max_frames]
+            slot["seq"] = 0
+            offset = self._data_offset + position % self.capacity
+            self._map[offset:offset + length] = data
+            slot["position"] = position
+            slot["timestamp"] = frame.timestamp
+            slot["length"] = length
+            slot["raw_bytes"] = min(frame.raw_bytes, 0xFFFFFFFF)
+            slot["crc"] = zlib.crc32(data)
+            slot["seq"] = seq  # commit
+            self._next_seq = seq + 1
+
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._map.flush()
+                self._last_flush = now
+
+    def snapshot(self, since=None, copy_margin=None):
+        # Frames oldest first, optionally only those captured after `since`,
+        # as zero-copy MappedFrames. Frames within copy_margin bytes (default:
+        # the ring's) of being overwritten are copied into EncodedFrames, so
+        # a reader that starts right away gets all of them.
+        if copy_margin is None:
+            copy_margin = self.copy_margin
+        with self._lock:
+            live = self._live_slots()
+            entries = self._index[live]
+            entries = entries[np.argsort(entries["seq"])]
+            if since is not None:
+                entries = entries[entries["timestamp"] > since]
+            doomed = self._end - self.capacity + copy_margin
+            frames = []
+            for e in entries:
+                frame = MappedFrame(self, int(e["seq"]), float(e["timestamp"]), int(e["position"]),
+                                    int(e["length"]), int(e["raw_bytes"]))
+                if frame.position < doomed:
+                    # Under the lock, so it cannot be overwritten mid-copy
+                    frame = EncodedFrame(frame.timestamp, bytes(frame.data), frame.raw_bytes)
+                frames.append(frame)
+            return frames
+
+    def clear(self):
+        with self._lock:
+            self._index["seq"] = 0
+            self._oldest = self._next_seq
+
+    def stats(self):
+        with self._lock:
+            entries = self._index[self._live_slots()]
+            frames = len(entries)
+            data_bytes = int(entries["length"].sum())
+            raw_bytes = int(entries["raw_bytes"].astype(np.int64).sum())
+            span = float(entries["timestamp"].max() - entries["timestamp"].min()) if frames > 1 else 0.0
+            return {
+                "storage": "mmap",
+                "path": self.path,
+                "frames": frames,
+                "bytes": data_bytes,
+                "byte_budget": self.capacity,
+                "seconds": round(span, 2),
+                "fps": round((frames - 1) / span, 1) if span > 0 else None,
+                "compression_ratio": round(raw_bytes / data_bytes, 1) if data_bytes else None,
+                "evicted": self.evicted
+            }
+
+    def flush(self):
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._index = None
+            self._map.close()
+            self._file.close()
+
+
+def recover(path, output_dir="recordings", prefix="recovered"):
+    # Write the frames left in a ring file (e.g. after a crash) to a clip;
+    # returns the clip path, or None when the ring holds no frames
+    from clip_export import write_clip
+
+    ring = MappedFrameRing.open(path)
+    try:
+        frames = ring.snapshot(copy_margin=0)
+        if not frames:
+            return None
+        os.makedirs(output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(frames[-1].timestamp))
+        output = os.path.join(output_dir, f"{prefix}_{stamp}.mp4")
+        write_clip(output, frames)
+        return output
+    finally:
+        ring.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recover the last clip from a black-box ring file")
+    parser.add_argument("ring", help="Ring file, e.g. recordings/blackbox.ring")
+    parser.add_argument("--output", default="recordings")
+    args = parser.parse_args(argv)
+
+    output = recover(args.ring, args.output)
+    if output is None:
+        print("No frames in the ring file")
+        return 1
+    print(f"Recovered clip saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,120 +1,141 @@
 import cv2
 import numpy as np
-import torch
-from ultralytics import YOLO
 from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 import time
+from frame_pipeline import FramePipeline
+from flow_engine import FlowEngine
+from tracker import MultiObjectTracker
+from geometry import box_centers, distance_to_lane, lane_polygon
+from frame_pool import FramePool
+from inference_service import get_service
+from stage_timer import NULL_TIMER
+from keyframe import KeyframeDetector
+from detection_planner import results_to_arrays
+from telemetry import DisplaySink, Sinks, TelemetrySink, make_record
 
 class accDetector:
-    def __init__(self, fps=30, scale_factor=0.05, smoothing_factor=0.4):
+    def __init__(self, fps=30, scale_factor=0.05, smoothing_factor=0.4,
+                 flow_scale=0.5, flow_mode="full"):
         self.fps = fps
         self.scale_factor = scale_factor
         self.alpha = smoothing_factor
-        self.prev_gray = None
+        # Grayscale + Farneback run once per frame and are shared by all boxes
+        self.flow_engine = FlowEngine(scale=flow_scale, mode=flow_mode)
         self.smoothed_accs = {}
         self.prev_centers = {}
         
-    def calculate_acc(self, frame, detection_data):
-        if self.prev_gray is None:
-            self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            return 0
-            
-        current_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        x1, y1, x2, y2 = detection_data['bbox']
-        obj_id = detection_data['id']
-        
-        # Crop regions for optical flow
-        prev_gray_crop = self.prev_gray[y1:y2, x1:x2]
-        current_gray_crop = current_gray[y1:y2, x1:x2]
-        
-        if prev_gray_crop.shape[0] > 1 and prev_gray_crop.shape[1] > 1:
-            flow = cv2.calcOpticalFlowFarneback(
-                prev_gray_crop, 
-                current_gray_crop, 
-                None, 
-                0.5, 3, 15, 3, 5, 1.2, 0
-            )
-            
-            mag = np.sqrt(flow[..., 0]**2 + flow[..., 1]**2)
-            avg_motion = np.mean(mag)
-            
-            dt = 1 / self.fps
-            acc_mps = (avg_motion * self.scale_factor) / dt
-            acc_kmph = acc_mps * 3.6
+    def calculate_accs(self, frame, detections):
+        boxes = np.array([d['bbox'] for d in detections], dtype=np.float32).reshape(-1, 4)
+        
+        if not self.flow_engine.update(frame, boxes):
+            return [0] * len(detections)
+        
+        avg_motion = self.flow_engine.box_motion(boxes)
+        
+        dt = 1 / self.fps
+        acc_mps = (avg_motion * self.scale_factor) / dt
+        acc_kmph = acc_mps * 3.6
+        
+        accs = []
+        for detection_data, acc in zip(detections, acc_kmph):
+            obj_id = detection_data['id']
             
-            if obj_id not in self.smoothed_accs:
-                self.smoothed_accs[obj_id] = acc_kmph
-            else:
-                self.smoothed_accs[obj_id] = (
-                    self.alpha * acc_kmph + 
-                    (1 - self.alpha) * self.smoothed_accs[obj_id]
-                )
+            # NaN means the box was too small to carry any flow
+            if not np.isnan(acc):
+                if obj_id not in self.smoothed_accs:
+                    self.smoothed_accs[obj_id] = float(acc)
+                else:
+                    self.smoothed_accs[obj_id] = (
+                        self.alpha * float(acc) + 
+                        (1 - self.alpha) * self.smoothed_accs[obj_id]
+                    )
             
-        self.prev_gray = current_gray
-        return self.smoothed_accs.get(obj_id, 0)
+            accs.append(self.smoothed_accs.get(obj_id, 0))
+        
+        return accs
+    
+    def forget(self, obj_ids):
+        for obj_id in obj_ids:
+            self.smoothed_accs.pop(obj_id, None)
+            self.prev_centers.pop(obj_id, None)
 
 class LaneDetector:
-    def __init__(self):
+    WHITE_LOWER = np.array([0, 0, 200], dtype=np.uint8)
+    WHITE_UPPER = np.array([180, 30, 255], dtype=np.uint8)
+    YELLOW_LOWER = np.array([20, 100, 100], dtype=np.uint8)
+    YELLOW_UPPER = np.array([30, 255, 255], dtype=np.uint8)
+    
+    def __init__(self, scale=1.0, roi_only=False):
+        # scale < 1 runs the colour threshold, Canny and Hough on a
+        # downscaled image; roi_only skips everything above the ROI horizon.
+        # Lines are always returned in full-frame coordinates.
+        self.scale = scale
+        self.roi_only = roi_only
         self.prev_left_line = None
         self.prev_right_line = None
         self.left_lines_history = deque(maxlen=3)  # Reduced history for lower latency
         self.right_lines_history = deque(maxlen=3)
+        self._geometry_cache = {}
         
-    def detect_lane(self, image):
-        height, width = image.shape[:2]
+    def _geometry(self, height, width):
+        # ROI mask and Hough parameters only depend on the frame size, so
+        # they are built once per resolution instead of once per frame
+        key = (height, width)
+        if key in self._geometry_cache:
+            return self._geometry_cache[key]
         
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        white_mask = cv2.inRange(
-            hsv,
-            np.array([0, 0, 200]),
-            np.array([180, 30, 255])
-        )
-        yellow_mask = cv2.inRange(
-            hsv,
-            np.array([20, 100, 100]),
-            np.array([30, 255, 255])
-        )
-        
-        mask = cv2.bitwise_or(white_mask, yellow_mask)
-        edges = cv2.Canny(mask, 50, 150)
+        y_offset = int(height * 0.5) if self.roi_only else 0
+        crop_height = int(round((height - y_offset) * self.scale))
+        crop_width = int(round(width * self.scale))
         
         roi_vertices = np.array([
             [(0, height),
              (width * 0.35, height * 0.5),
              (width * 0.65, height * 0.5),
              (width, height)]
-        ], dtype=np.int32)
-        
-        roi_mask = np.zeros_like(edges)
-        cv2.fillPoly(roi_mask, roi_vertices, 255)
-        masked_edges = cv2.bitwise_and(edges, roi_mask)
-        
-        lines = cv2.HoughLinesP(
-            masked_edges,
-            rho=1,
-            theta=np.pi/180,
-            threshold=20,
-            minLineLength=30,
-            maxLineGap=50
-        )
+        ], dtype=np.float64)
+        roi_vertices[..., 1] -= y_offset
+        roi_vertices *= self.scale
         
-        left_lines, right_lines = [], []
-        if lines is not None:
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                if x2 - x1 == 0:
-                    continue
-                    
-                slope = (y2 - y1) / (x2 - x1)
-                if abs(slope) < 0.3 or abs(slope) > 2.0:
-                    continue
-                    
-                if slope < 0:
-                    left_lines.append(line[0])
-                else:
-                    right_lines.append(line[0])
+        roi_mask = np.zeros((crop_height, crop_width), dtype=np.uint8)
+        cv2.fillPoly(roi_mask, roi_vertices.astype(np.int32), 255)
+        
+        geometry = {
+            'y_offset': y_offset,
+            'size': (crop_width, crop_height),
+            'roi_mask': roi_mask,
+            'hough': dict(
+                rho=1,
+                theta=np.pi/180,
+                threshold=max(1, int(round(20 * self.scale))),
+                minLineLength=max(1, int(round(30 * self.scale))),
+                maxLineGap=max(1, int(round(50 * self.scale)))
+            )
+        }
+        self._geometry_cache[key] = geometry
+        return geometry
+        
+    def detect_lane(self, image):
+        height, width = image.shape[:2]
+        geometry = self._geometry(height, width)
+        
+        crop = image[geometry['y_offset']:]
+        if self.scale != 1.0:
+            crop = cv2.resize(crop, geometry['size'], interpolation=cv2.INTER_AREA)
+        
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        
+        white_mask = cv2.inRange(hsv, self.WHITE_LOWER, self.WHITE_UPPER)
+        yellow_mask = cv2.inRange(hsv, self.YELLOW_LOWER, self.YELLOW_UPPER)
+        
+        mask = cv2.bitwise_or(white_mask, yellow_mask, dst=white_mask)
+        edges = cv2.Canny(mask, 50, 150)
+        masked_edges = cv2.bitwise_and(edges, geometry['roi_mask'], dst=edges)
+        
+        lines = cv2.HoughLinesP(masked_edges, **geometry['hough'])
+        
+        left_lines, right_lines = self._classify_segments(lines, geometry)
         
         left_line = self._process_lane_lines(left_lines, height, True)
         right_line = self._process_lane_lines(right_lines, height, False)
@@ -136,12 +157,32 @@ class LaneDetector:
         
         return lane_center, lane_width, left_line, right_line
 
+    def _classify_segments(self, lines, geometry):
+        if lines is None:
+            empty = np.empty((0, 4))
+            return empty, empty
+        
+        # Back to full-frame coordinates; slopes are unchanged by this
+        segments = lines.reshape(-1, 4).astype(np.float64)
+        if self.scale != 1.0:
+            segments /= self.scale
+        segments[:, [1, 3]] += geometry['y_offset']
+        
+        dx = segments[:, 2] - segments[:, 0]
+        dy = segments[:, 3] - segments[:, 1]
+        valid = dx != 0
+        slope = np.divide(dy, dx, out=np.zeros_like(dy), where=valid)
+        abs_slope = np.abs(slope)
+        keep = valid & (abs_slope >= 0.3) & (abs_slope <= 2.0)
+        
+        return segments[keep & (slope < 0)], segments[keep & (slope > 0)]
+
     def _process_lane_lines(self, lines, height, is_left):
-        if not lines:
+        if len(lines) == 0:
             return self.prev_left_line if is_left else self.prev_right_line
-            
-        points = np.array([(x1, y1) for x1, y1, x2, y2 in lines] + 
-                         [(x2, y2) for x1, y1, x2, y2 in lines])
+        
+        # Both endpoints of every segment as (x, y) rows
+        points = lines.reshape(-1, 2)
         
         coeffs = np.polyfit(points[:, 1], points[:, 0], deg=1)
         
@@ -164,126 +205,361 @@ class LaneDetector:
             return None
         return np.mean(list(line_history), axis=0, dtype=np.int32)
 
+class VehicleHistoryStore:
+    # Last-seen state per track ID in parallel NumPy arrays. Lookups for a
+    # whole frame are one argsort + searchsorted, and entries not seen for
+    # `ttl` seconds are evicted so the store never outgrows the scene.
+    def __init__(self, capacity=64, ttl=5.0):
+        self.ttl = ttl
+        self.size = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.x = np.empty(capacity, dtype=np.float64)
+        self.y = np.empty(capacity, dtype=np.float64)
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.acc = np.empty(capacity, dtype=np.float64)
+        
+    def __len__(self):
+        return self.size
+    
+    def _fields(self):
+        return ('ids', 'x', 'y', 'time', 'acc')
+    
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.ids))
+        for name in self._fields():
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+    
+    def _keep(self, keep):
+        n = int(keep.sum())
+        for name in self._fields():
+            arr = getattr(self, name)
+            arr[:n] = arr[:self.size][keep]
+        self.size = n
+    
+    def lookup(self, ids):
+        # Slot index of every ID, -1 where the ID is unknown
+        ids = np.asarray(ids, dtype=np.int64)
+        slots = np.full(len(ids), -1, dtype=np.int64)
+        if self.size == 0 or len(ids) == 0:
+            return slots
+        
+        order = np.argsort(self.ids[:self.size])
+        sorted_ids = self.ids[:self.size][order]
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), self.size - 1)
+        found = sorted_ids[pos] == ids
+        slots[found] = order[pos[found]]
+        return slots
+    
+    def upsert(self, ids, x, y, frame_time, acc):
+        ids = np.asarray(ids, dtype=np.int64)
+        slots = self.lookup(ids)
+        
+        new = slots < 0
+        n_new = int(new.sum())
+        if self.size + n_new > len(self.ids):
+            self._grow(self.size + n_new)
+        slots[new] = np.arange(self.size, self.size + n_new)
+        self.size += n_new
+        
+        self.ids[slots] = ids
+        self.x[slots] = x
+        self.y[slots] = y
+        self.time[slots] = frame_time
+        self.acc[slots] = acc
+    
+    def evict_stale(self, now):
+        if self.size:
+            keep = self.time[:self.size] >= now - self.ttl
+            if not keep.all():
+                self._keep(keep)
+    
+    def remove(self, ids):
+        if self.size:
+            self._keep(~np.isin(self.ids[:self.size], np.asarray(ids, dtype=np.int64)))
+
 class RiskAssessor:
-    def __init__(self):
-        self.vehicle_history = {}
+    RISK_LEVELS = np.array(["SAFE", "WARNING", "DANGER"])
+    
+    def __init__(self, history_ttl=5.0):
+        self.vehicle_history = VehicleHistoryStore(ttl=history_ttl)
         self.risk_threshold_close = 50
         self.risk_threshold_acc = 15
         
-    def calculate_risk(self, vehicle_data, lane_center, lane_width, frame_time):
-        vehicle_id = vehicle_data['id']
-        vehicle_x = vehicle_data['center_x']
-        vehicle_y = vehicle_data['center_y']
-        vehicle_acc = vehicle_data.get('acc', 0)
+    def assess_batch(self, centers, accs, track_ids, lane_center, lane_width, frame_time):
+        # Score every vehicle of a frame at once. `centers` is (N, 2), `accs`
+        # and `track_ids` are (N,). Returns (levels, scores) as arrays.
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        accs = np.asarray(accs, dtype=np.float64).reshape(-1)
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
         
-        if vehicle_id in self.vehicle_history:
-            prev_data = self.vehicle_history[vehicle_id]
-            
-            acc_factor = min(1.0, vehicle_acc / 50.0)
-            proximity_factor = min(1.0, (lane_width - abs(vehicle_x - lane_center)) / self.risk_threshold_close)
-            lane_invasion = abs(vehicle_x - lane_center) < (lane_width * 0.4)
-            
-            risk_score = (
-                acc_factor * 0.5 +
-                proximity_factor * 0.4 +
-                float(lane_invasion) * 0.1
-            )
-            
-            risk_level = "SAFE"
-            if risk_score > 0.7:
-                risk_level = "DANGER"
-            elif risk_score > 0.4:
-                risk_level = "WARNING"
-                
-        else:
-            risk_level = "SAFE"
-            risk_score = 0
-            
-        self.vehicle_history[vehicle_id] = {
-            'x': vehicle_x,
-            'y': vehicle_y,
-            'time': frame_time,
-            'acc': vehicle_acc
-        }
+        self.vehicle_history.evict_stale(frame_time)
+        seen = self.vehicle_history.lookup(track_ids) >= 0
+        
+        offset = np.abs(centers[:, 0] - lane_center)
+        acc_factor = np.minimum(1.0, accs / 50.0)
+        proximity_factor = np.minimum(1.0, (lane_width - offset) / self.risk_threshold_close)
+        lane_invasion = offset < (lane_width * 0.4)
+        
+        risk_scores = (
+            acc_factor * 0.5 +
+            proximity_factor * 0.4 +
+            lane_invasion * 0.1
+        )
+        # First sighting of a vehicle is always SAFE
+        risk_scores = np.where(seen, risk_scores, 0.0)
+        
+        level_idx = (risk_scores > 0.4).astype(np.int64) + (risk_scores > 0.7)
+        risk_levels = self.RISK_LEVELS[level_idx]
         
-        return risk_level, risk_score
+        self.vehicle_history.upsert(
+            track_ids, centers[:, 0], centers[:, 1], frame_time, accs
+        )
+        return risk_levels, risk_scores
+        
+    def calculate_risk(self, vehicle_data, lane_center, lane_width, frame_time):
+        risk_levels, risk_scores = self.assess_batch(
+            [(vehicle_data['center_x'], vehicle_data['center_y'])],
+            [vehicle_data.get('acc', 0)],
+            [vehicle_data['id']],
+            lane_center, lane_width, frame_time
+        )
+        return str(risk_levels[0]), float(risk_scores[0])
+    
+    def forget(self, vehicle_ids):
+        self.vehicle_history.remove(vehicle_ids)
+
+# Long-lived worker so lane detection can overlap YOLO in process_frame
+# without creating a thread pool on every frame
+_lane_executor = ThreadPoolExecutor(max_workers=1)
+
+RISK_COLORS = {
+    "SAFE": (0, 255, 0),
+    "WARNING": (0, 255, 255),
+    "DANGER": (0, 0, 255)
+}
 
-def process_frame(frame, model, lane_detector, acc_detector, risk_assessor, frame_time):
-    # Resize frame for faster processing
-    frame = cv2.resize(frame, (640, 480))
+# Resized frames are pooled: the pipeline acquires one per captured frame and
+# main() releases it once the frame has been shown; render_frame's blend
+# buffers are only used by the render stage
+frame_pool = FramePool()
+
+def prepare_frame(frame, name=None):
+    # Resize frame for faster processing, into a pooled buffer (the named
+    # scratch buffer, reused on every call, or an acquired one)
+    return frame_pool.resize(frame, (640, 480), name=name)
+
+def extract_detections(results, conf_threshold=0.5):
+    # Flatten YOLO results into (N, 4) int boxes, confidences and classes
+    boxes, confs, classes = results_to_arrays(results)
+    keep = confs >= conf_threshold
+    return boxes[keep].astype(np.int32), confs[keep], classes[keep]
+
+def run_detector(model, frame):
+    # `model` is a YOLO model/client, or a KeyframeDetector wrapping one
+    if isinstance(model, KeyframeDetector):
+        return model.detect(frame)
+    return extract_detections(model(frame, verbose=False))
+
+def make_keyframe_detector(model, budget_ms=1000.0 / 30, max_interval=6):
+    # YOLO on keyframes only, boxes carried by sparse optical flow in between
+    return KeyframeDetector(
+        lambda frame: extract_detections(model(frame, verbose=False)),
+        budget_ms=budget_ms,
+        max_interval=max_interval
+    )
+
+def score_detections(frame, detections, lane_info, tracker, acc_detector, risk_assessor,
+                     frame_time, timer=NULL_TIMER):
+    lane_center, lane_width, left_line, right_line = lane_info
+    boxes, confs, classes = detections
     
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        lane_future = executor.submit(lane_detector.detect_lane, frame)
-        yolo_future = executor.submit(model, frame, verbose=False)
-        
-        lane_center, lane_width, left_line, right_line = lane_future.result()
-        results = yolo_future.result()
+    # Stable track IDs; per-ID state of expired tracks is released right away
+    with timer('track'):
+        track_ids = tracker.update(boxes, classes)
+        if tracker.expired_ids:
+            acc_detector.forget(tracker.expired_ids)
+            risk_assessor.forget(tracker.expired_ids)
+    
+    detections = []
+    for (x1, y1, x2, y2), cls, track_id in zip(boxes.tolist(), classes.tolist(), track_ids.tolist()):
+        detections.append({
+            'id': track_id,
+            'cls': cls,
+            'bbox': (x1, y1, x2, y2),
+            'center_x': (x1 + x2) // 2,
+            'center_y': (y1 + y2) // 2
+        })
+    
+    # One optical-flow pass for the whole frame, shared by every detection
+    with timer('flow'):
+        accs = acc_detector.calculate_accs(frame, detections)
+    
+    with timer('risk'):
+        risk_levels, risk_scores = risk_assessor.assess_batch(
+            box_centers(boxes), accs, track_ids, lane_center, lane_width, frame_time
+        )
+        # Signed pixels from each vehicle to the nearer lane line at its row,
+        # positive inside the lane
+        if left_line is not None and right_line is not None:
+            lane_dists = distance_to_lane(boxes, left_line, right_line)[0].round(1).tolist()
+        else:
+            lane_dists = [None] * len(detections)
+    
+    for detection_data, acc, lane_dist, risk_level, risk_score in zip(
+            detections, accs, lane_dists, risk_levels.tolist(), risk_scores.tolist()):
+        detection_data['acc'] = acc
+        detection_data['lane_dist'] = lane_dist
+        detection_data['risk_level'] = risk_level
+        detection_data['risk_score'] = risk_score
+    
+    return detections
+
+def render_frame(frame, lane_info, detections):
+    _, _, left_line, right_line = lane_info
     
     if left_line is not None and right_line is not None:
-        overlay = frame.copy()
-        cv2.fillPoly(overlay, [np.array([
-            [left_line[0], left_line[1]],
-            [left_line[2], left_line[3]],
-            [right_line[2], right_line[3]],
-            [right_line[0], right_line[1]]
-        ])], (0, 255, 0, 128))
-        cv2.addWeighted(overlay, 0.35, frame, 0.65, 0, frame)
-    
-    for result in results:
-        for box in result.boxes:
-            cls = int(box.cls[0])
-            conf = float(box.conf[0])
-            
-            if conf >= 0.5:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                
-                detection_data = {
-                    'id': f"{cls}_{x1}_{y1}",
-                    'bbox': (x1, y1, x2, y2),
-                    'center_x': (x1 + x2) // 2,
-                    'center_y': (y1 + y2) // 2
-                }
-                
-                acc = acc_detector.calculate_acc(frame, detection_data)
-                detection_data['acc'] = acc
-                
-                risk_level, risk_score = risk_assessor.calculate_risk(
-                    detection_data, lane_center, lane_width, frame_time
-                )
-                
-                color = {
-                    "SAFE": (0, 255, 0),
-                    "WARNING": (0, 255, 255),
-                    "DANGER": (0, 0, 255)
-                }[risk_level]
-                
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                
-                info_text = [
-                    f"ID: {detection_data['id']}",
-                    f"acc: {acc:.1f} km/h",
-                    f"Risk: {risk_level}",
-                    f"Score: {risk_score:.2f}"
-                ]
-                
-                for i, text in enumerate(info_text):
-                    y_offset = y1 - 10 - (i * 15)
-                    cv2.putText(frame, text, (x1, y_offset),
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+        # Same as blending a filled overlay copy at 0.35, without the copy
+        frame_pool.blend_polygon(frame, lane_polygon(left_line, right_line), (0, 255, 0), 0.65, 0.35)
+    
+    for detection_data in detections:
+        x1, y1, x2, y2 = detection_data['bbox']
+        risk_level = detection_data['risk_level']
+        color = RISK_COLORS[risk_level]
+        
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        
+        info_text = [
+            f"ID: {detection_data['id']}",
+            f"acc: {detection_data['acc']:.1f} km/h",
+            f"Risk: {risk_level}",
+            f"Score: {detection_data['risk_score']:.2f}"
+        ]
+        
+        for i, text in enumerate(info_text):
+            y_offset = y1 - 10 - (i * 15)
+            cv2.putText(frame, text, (x1, y_offset),
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
     
     return frame
 
+def frame_record(index, frame_time, lane_info, detections, **extra):
+    # Compact telemetry record of one analysed frame
+    lane_center, lane_width, left_line, right_line = lane_info
+    lane = {"c": lane_center, "w": lane_width, "l": left_line, "r": right_line}
+    objects = [{
+        "id": d['id'],
+        "cls": d['cls'],
+        "box": d['bbox'],
+        "acc": d['acc'],
+        "ld": d['lane_dist'],
+        "risk": d['risk_level'],
+        "score": d['risk_score']
+    } for d in detections]
+    return make_record(index, frame_time, objects, lane, **extra)
+
+def draw_fps(frame, fps):
+    cv2.putText(frame, f"FPS: {fps:.1f}",
+               (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
+               1, (0, 255, 0), 2)
+    return frame
+
+def _timed(timer, stage, fn, *args):
+    with timer(stage):
+        return fn(*args)
+
+def process_frame(frame, model, lane_detector, tracker, acc_detector, risk_assessor,
+                  frame_time, timer=NULL_TIMER, render=True):
+    # Synchronous single-frame path; main() uses build_pipeline instead.
+    # Returns the annotated frame, or (lane_info, detections) when headless.
+    # The returned frame's buffer is reused by the next call.
+    with timer('resize'):
+        frame = prepare_frame(frame, name='process_frame')
+    
+    lane_future = _lane_executor.submit(_timed, timer, 'lane', lane_detector.detect_lane, frame)
+    with timer('detect'):
+        raw_detections = run_detector(model, frame)
+    lane_info = lane_future.result()
+    
+    detections = score_detections(
+        frame, raw_detections, lane_info, tracker, acc_detector, risk_assessor, frame_time, timer
+    )
+    if not render:
+        return lane_info, detections
+    with timer('render'):
+        return render_frame(frame, lane_info, detections)
+
+def build_pipeline(cap, model, lane_detector, tracker, acc_detector, risk_assessor,
+                   queue_size=2, drop_oldest=True, render=True):
+    # Capture, lane detection, YOLO, scoring and rendering each get their own
+    # thread so consecutive frames are processed concurrently. Stateful
+    # components are only ever touched by one stage, so they need no locks.
+    # Without `render` the pipeline ends at scoring and no drawing is done.
+    def capture():
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        return {'frame': prepare_frame(frame), 'frame_time': time.time()}
+    
+    def lane_stage(packet):
+        packet['lane'] = lane_detector.detect_lane(packet['frame'])
+        return packet
+    
+    def detect_stage(packet):
+        packet['raw_detections'] = run_detector(model, packet['frame'])
+        return packet
+    
+    def score_stage(packet):
+        packet['detections'] = score_detections(
+            packet['frame'], packet['raw_detections'], packet['lane'],
+            tracker, acc_detector, risk_assessor, packet['frame_time']
+        )
+        return packet
+    
+    def render_stage(packet):
+        packet['frame'] = render_frame(packet['frame'], packet['lane'], packet['detections'])
+        return packet
+    
+    stages = [
+        ("lane", lane_stage),
+        ("detect", detect_stage),
+        ("score", score_stage)
+    ]
+    if render:
+        stages.append(("render", render_stage))
+    
+    def drop_packet(packet):
+        # Frames discarded by a full queue go back to the pool
+        frame_pool.release(packet['frame'])
+    
+    return FramePipeline(
+        capture,
+        stages,
+        queue_size=queue_size,
+        drop_oldest=drop_oldest,
+        on_drop=drop_packet
+    )
+
 def main():
     # You can change this to 0 for webcam or provide a video path
     VIDEO_SOURCE = "test_videos\lane.mp4"  # Replace with your video path
     
-    # Initialize YOLO model
-    model = YOLO('yolov8n.pt')
-    if torch.cuda.is_available():
-        model.to('cuda')
-        print("Using CUDA")
-    else:
-        print("Using CPU")
+    # Inference backend: "torch" (eager PyTorch), "onnx" or "torchscript".
+    # The exported graphs run noticeably faster on the CPU-only boards (they
+    # need onnxruntime and are exported on first run), and INT8_MODEL
+    # quantizes the ONNX graph further. Falls back to torch when the
+    # exported backend cannot be loaded.
+    INFERENCE_BACKEND = "torch"
+    INT8_MODEL = False
+
+    # Shared YOLO model; other camera pipelines in this process reuse it and
+    # their frames are batched together
+    model = get_service(
+        backend=INFERENCE_BACKEND, int8=INT8_MODEL, fallback=True
+    ).client('yolov8n.pt')
+    print(f"Using {model.model.name} inference backend")
     
     # Initialize video capture
     try:
@@ -306,52 +582,67 @@ def main():
     if fps == 0:  # If FPS is 0 (common with webcams), set to 30
         fps = 30
     
+    # Run YOLO only on keyframes and track boxes in between; the keyframe
+    # interval adapts so detection keeps up with the camera frame rate
+    KEYFRAME_MODE = True
+    if KEYFRAME_MODE:
+        model = make_keyframe_detector(model, budget_ms=1000.0 / fps)
+    
     # Initialize components
     lane_detector = LaneDetector()
+    tracker = MultiObjectTracker()
     acc_detector = accDetector(fps=fps)  # Pass the correct FPS
     risk_assessor = RiskAssessor()
     
+    # Headless mode skips all drawing and only streams telemetry records (on
+    # the bike there is no screen); TELEMETRY_PATH = None disables the records
+    HEADLESS = False
+    TELEMETRY_PATH = "telemetry/risk_speed.jsonl"
+    
+    # Keep the newest frame when the pipeline falls behind a live camera;
+    # set to False to process every frame of a recorded video
+    DROP_OLDEST_FRAMES = True
+    pipeline = build_pipeline(
+        cap, model, lane_detector, tracker, acc_detector, risk_assessor,
+        queue_size=2, drop_oldest=DROP_OLDEST_FRAMES, render=not HEADLESS
+    )
+    sinks = Sinks([
+        TelemetrySink(TELEMETRY_PATH) if TELEMETRY_PATH else None,
+        None if HEADLESS else DisplaySink(draw_fps, window='Vehicle Detection')
+    ])
+    
     frame_count = 0
     start_time = time.time()
     fps_display = 0
     
     try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("End of video file or error reading frame")
-                break
-                
+        for packet in pipeline.results():
             frame_count += 1
             current_time = time.time()
             
-            # Process frame
-            processed_frame = process_frame(
-                frame,
-                model,
-                lane_detector,
-                acc_detector,
-                risk_assessor,
-                current_time
-            )
-            
-            # Calculate and display FPS
+            # Calculate FPS
             if frame_count % 30 == 0:
                 fps_display = 30.0 / (current_time - start_time)
                 start_time = current_time
-                
-            cv2.putText(processed_frame, f"FPS: {fps_display:.1f}",
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                       1, (0, 255, 0), 2)
             
-            # Display the frame
-            cv2.imshow('Vehicle Detection', processed_frame)
+            record = frame_record(
+                frame_count, packet['frame_time'], packet['lane'], packet['detections']
+            )
+            sinks(packet['frame'], record, fps_display)
+            frame_pool.release(packet['frame'])
             
             # Break loop on 'q' press
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if sinks.stopped:
                 break
+        else:
+            print("End of video file or error reading frame")
                 
     finally:
+        pipeline.stop()
+        sinks.close()
+        print(f"Pipeline stats: {pipeline.stats()}")
+        if isinstance(model, KeyframeDetector):
+            print(f"Keyframe stats: {model.stats()}")
         cap.release()
         cv2.destroyAllWindows()
 
@@ -1,16 +1,9 @@
 import cv2
-import torch
 import numpy as np
-from ultralytics import YOLO
-from scipy.spatial import distance
-
-# Load the YOLO model
-model_path = "models/vehicle.pt"
-model = YOLO(model_path)
-
-# Check if CUDA is available
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-model.to(device)
+from association import CentroidAssociator
+from frame_pool import FramePool
+from inference_service import get_service
+from telemetry import DisplaySink, Sinks, TelemetrySink, make_record
 
 # Open video file
 # VIDEO_SOURCE = "videos/stock-footage.mp4" 
@@ -18,103 +11,79 @@ model.to(device)
 # VIDEO_SOURCE = "videos/night.mp4"
 VIDEO_SOURCE = "videos/crash.mp4"
 
-cap = cv2.VideoCapture(VIDEO_SOURCE)
-
-# Get video FPS (frames per second)
-fps = cap.get(cv2.CAP_PROP_FPS)
-
-# Define scale factor (pixels to meters) - adjust based on real-world calibration
-scale_factor = 0.05  # 1 pixel = 0.05 meters
-
-# Smoothing factor for exponential moving average
-alpha = 0.4  
+# YOLO weights, loaded through the shared inference service in main()
+MODEL_PATH = "models/vehicle.pt"
 
-# Dictionaries to store smoothed speeds, object IDs, and previous bounding box centers
-smoothed_speeds = {}
-prev_centers = {}
-object_ids = {}
-next_object_id = 1  # Counter for assigning new IDs
-
-# Read the first frame and convert it to grayscale
-ret, prev_frame = cap.read()
-if not ret:
-    print("Error: Couldn't read video file.")
-    cap.release()
-    exit()
-
-prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
+# Headless mode skips the flow visualization and all drawing and only
+# streams per-frame speed records; TELEMETRY_PATH = None disables them
+HEADLESS = False
+TELEMETRY_PATH = "telemetry/speed_final.jsonl"
 
-    # Convert to grayscale for optical flow calculation
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+# Output frame and flow-visualization buffers reused by render_estimates
+frame_pool = FramePool()
 
-    # Run YOLO inference
+def detect_boxes(model, frame):
+    # Run YOLO inference and return the bounding box coordinates
     results = model(frame, verbose=False)
-
-    # Copy frame to overlay results
-    output_frame = frame.copy()
-
-    frame_height = frame.shape[0]  # Get bottom of frame
-
-    detected_objects = []  # Store detected object centers for matching
-
+    boxes = []
     for result in results:
         for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])  # Bounding box coordinates
-
+            boxes.append(tuple(map(int, box.xyxy[0])))
+    return boxes
+
+class SpeedEstimator:
+    def __init__(self, fps, scale_factor=0.05, alpha=0.4, match_threshold=50):
+        self.fps = fps
+        # Define scale factor (pixels to meters) - adjust based on real-world calibration
+        self.scale_factor = scale_factor  # 1 pixel = 0.05 meters
+        # Smoothing factor for exponential moving average
+        self.alpha = alpha
+        self.match_threshold = match_threshold
+
+        # Dictionaries to store smoothed speeds and previous bounding box centers
+        self.smoothed_speeds = {}
+        self.prev_centers = {}
+        # Matches bottom-center points between frames and hands out object IDs
+        self.associator = CentroidAssociator(max_distance=match_threshold)
+        self.prev_gray = None
+        # Grayscale frames alternate between two pooled buffers
+        self.pool = FramePool()
+        self._gray_slot = 0
+
+    def _gray(self, frame):
+        self._gray_slot ^= 1
+        gray = self.pool.scratch(f"gray{self._gray_slot}", frame.shape[:2])
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    def start(self, frame):
+        # Seed the optical flow with the first frame
+        self.prev_gray = self._gray(frame)
+
+    def assign_ids(self, boxes):
+        # Match detected objects (bottom center) to the previous frame's with
+        # one optimal assignment; returns one ID per box, in box order
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        centers = np.stack([(boxes[:, 0] + boxes[:, 2]) // 2, boxes[:, 3]], axis=1)
+        return self.associator.update(centers).tolist()
+
+    def estimate_speeds(self, frame, boxes, ids, keep_flow=True):
+        # keep_flow stores the per-box flow magnitude and angle that
+        # render_estimates visualizes; headless runs skip the angle entirely
+        # Convert to grayscale for optical flow calculation
+        gray = self._gray(frame)
+        if self.prev_gray is None:
+            self.prev_gray = gray
+
+        frame_height = frame.shape[0]  # Get bottom of frame
+        estimates = []
+
+        for (x1, y1, x2, y2), obj_id in zip(boxes, ids):
             # Calculate bottom center of bounding box
-            center_x = (x1 + x2) // 2
-            center_y = y2  # Bottom center Y
-            detected_objects.append((center_x, center_y))  # Store for ID assignment
-
-    # Match detected objects to existing IDs using Euclidean distance
-    new_object_ids = {}
-    for center_x, center_y in detected_objects:
-        min_distance = float('inf')
-        assigned_id = None
-
-        # Find the closest previous object
-        for obj_id, (prev_x, prev_y) in object_ids.items():
-            dist = distance.euclidean((center_x, center_y), (prev_x, prev_y))
-            if dist < min_distance and dist < 50:  # Threshold for matching
-                min_distance = dist
-                assigned_id = obj_id
-
-        # Assign new ID if no match is found
-        if assigned_id is None:
-            assigned_id = next_object_id
-            next_object_id += 1
-
-        new_object_ids[assigned_id] = (center_x, center_y)
-
-    # Update the object IDs with the new frame's detections
-    object_ids = new_object_ids
-
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])  # Bounding box coordinates
-
-            # Calculate bottom center of bounding box
-            center_x = (x1 + x2) // 2
             center_y = y2
             distance_from_bottom = frame_height - center_y
 
-            # Find the corresponding object ID
-            obj_id = None
-            for id_key, (cx, cy) in object_ids.items():
-                if cx == center_x and cy == center_y:
-                    obj_id = id_key
-                    break
-
-            if obj_id is None:
-                continue  # Skip if no ID was found (shouldn't happen)
-
             # Crop bounding box area from grayscale frames
-            prev_gray_crop = prev_gray[y1:y2, x1:x2]
+            prev_gray_crop = self.prev_gray[y1:y2, x1:x2]
             gray_crop = gray[y1:y2, x1:x2]
 
             if prev_gray_crop.shape[0] > 1 and prev_gray_crop.shape[1] > 1:
@@ -122,63 +91,143 @@ while cap.isOpened():
                 flow = cv2.calcOpticalFlowFarneback(prev_gray_crop, gray_crop, None, 
                                                     0.5, 3, 15, 3, 5, 1.2, 0)
 
-                # Compute magnitude and direction of flow
-                mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+                # Compute magnitude (and, for display, direction) of flow
+                if keep_flow:
+                    mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+                else:
+                    mag = cv2.magnitude(flow[..., 0], flow[..., 1])
 
                 # Compute average motion magnitude
                 avg_motion = np.mean(mag)
 
                 # Convert to real-world speed using Optical Flow
-                dt = 1 / fps  # Time interval between frames
-                speed_mps = (avg_motion * scale_factor) / dt  # Speed in meters per second
+                dt = 1 / self.fps  # Time interval between frames
+                speed_mps = (avg_motion * self.scale_factor) / dt  # Speed in meters per second
                 speed_kmph = speed_mps * 3.6  # Convert to km/h
 
                 # Apply exponential smoothing
-                if obj_id not in smoothed_speeds:
-                    smoothed_speeds[obj_id] = speed_kmph  # Initialize
+                if obj_id not in self.smoothed_speeds:
+                    self.smoothed_speeds[obj_id] = speed_kmph  # Initialize
 
-                smoothed_speeds[obj_id] = alpha * speed_kmph + (1 - alpha) * smoothed_speeds[obj_id]
+                self.smoothed_speeds[obj_id] = self.alpha * speed_kmph + (1 - self.alpha) * self.smoothed_speeds[obj_id]
 
                 # Compute speed using bounding box displacement method
-                if obj_id in prev_centers:
-                    prev_distance = prev_centers[obj_id]
+                if obj_id in self.prev_centers:
+                    prev_distance = self.prev_centers[obj_id]
                     pixel_displacement = abs(distance_from_bottom - prev_distance)
-                    speed_bb_mps = (pixel_displacement * scale_factor) / dt  # Speed in m/s
+                    speed_bb_mps = (pixel_displacement * self.scale_factor) / dt  # Speed in m/s
                     speed_bb_kmph = speed_bb_mps * 3.6  # Convert to km/h
                 else:
                     speed_bb_kmph = 0  # No previous data
 
                 # Store current center for next frame
-                prev_centers[obj_id] = distance_from_bottom
-
-                # Convert flow visualization to HSV format
-                hsv = np.zeros_like(frame[y1:y2, x1:x2])
-                hsv[..., 1] = 255  # Full saturation
-                hsv[..., 0] = ang * 180 / np.pi / 2  # Hue represents direction
-                hsv[..., 2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)  # Value represents speed
-
-                # Convert HSV to BGR and overlay on frame
-                flow_rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-                output_frame[y1:y2, x1:x2] = flow_rgb
-
-                # Display unique object ID and both speeds
-                cv2.putText(output_frame, f"ID: {obj_id}", (x1, y1 - 40), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 255, 0), 1)
-                cv2.putText(output_frame, f"Optical: {smoothed_speeds[obj_id]:.2f} km/h", 
-                            (x1, y1 - 25), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 255, 255), 1)
-                cv2.putText(output_frame, f"BB Dist: {speed_bb_kmph:.2f} km/h", 
-                            (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 0), 1)
-
-
-    # Display the output
-    cv2.imshow("Optical Flow - Smoothed Speed Estimation", output_frame)
-
-    # Update previous frame
-    prev_gray = gray.copy()
-
-    # Exit on pressing 'q'
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+                self.prev_centers[obj_id] = distance_from_bottom
+
+                estimate = {
+                    'id': obj_id,
+                    'bbox': (x1, y1, x2, y2),
+                    'optical_kmph': self.smoothed_speeds[obj_id],
+                    'bb_kmph': speed_bb_kmph
+                }
+                if keep_flow:
+                    estimate['mag'] = mag
+                    estimate['ang'] = ang
+                estimates.append(estimate)
+
+        # Update previous frame
+        self.prev_gray = gray
+        return estimates
+
+    def process(self, frame, boxes, keep_flow=True):
+        ids = self.assign_ids(boxes)
+        return self.estimate_speeds(frame, boxes, ids, keep_flow)
+
+def frame_record(index, frame_time, estimates):
+    # Compact telemetry record of one analysed frame
+    objects = [{
+        'id': e['id'],
+        'box': e['bbox'],
+        'optical_kmph': e['optical_kmph'],
+        'bb_kmph': e['bb_kmph']
+    } for e in estimates]
+    return make_record(index, frame_time, objects)
+
+def render_estimates(frame, estimates):
+    # Copy frame to overlay results (the same output buffer every frame)
+    output_frame = frame_pool.scratch('output', frame.shape, frame.dtype)
+    np.copyto(output_frame, frame)
+
+    for estimate in estimates:
+        x1, y1, x2, y2 = estimate['bbox']
+        mag, ang = estimate['mag'], estimate['ang']
+
+        # Convert flow visualization to HSV format
+        hsv = frame_pool.scratch('hsv', mag.shape + (3,))
+        hsv[..., 1] = 255  # Full saturation
+        np.multiply(ang, 90 / np.pi, out=hsv[..., 0], casting='unsafe')  # Hue represents direction
+        hsv[..., 2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)  # Value represents speed
+
+        # Convert HSV to BGR and overlay on frame
+        flow_rgb = frame_pool.scratch('flow', hsv.shape)
+        cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=flow_rgb)
+        output_frame[y1:y2, x1:x2] = flow_rgb
+
+        # Display unique object ID and both speeds
+        cv2.putText(output_frame, f"ID: {estimate['id']}", (x1, y1 - 40), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 255, 0), 1)
+        cv2.putText(output_frame, f"Optical: {estimate['optical_kmph']:.2f} km/h", 
+                    (x1, y1 - 25), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 255, 255), 1)
+        cv2.putText(output_frame, f"BB Dist: {estimate['bb_kmph']:.2f} km/h", 
+                    (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 0), 1)
+
+    return output_frame
+
+def main():
+    model = get_service().client(MODEL_PATH)
+
+    cap = cv2.VideoCapture(VIDEO_SOURCE)
+
+    # Get video FPS (frames per second)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    # Read the first frame and convert it to grayscale
+    ret, prev_frame = cap.read()
+    if not ret:
+        print("Error: Couldn't read video file.")
+        cap.release()
+        return
+
+    estimator = SpeedEstimator(fps)
+    estimator.start(prev_frame)
+
+    sinks = Sinks([
+        TelemetrySink(TELEMETRY_PATH) if TELEMETRY_PATH else None,
+        None if HEADLESS else DisplaySink(
+            render_estimates, window="Optical Flow - Smoothed Speed Estimation"
+        )
+    ])
+
+    index = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        index += 1
+
+        boxes = detect_boxes(model, frame)
+        estimates = estimator.process(frame, boxes, keep_flow=sinks.rendering)
+
+        # Video time of the frame, so records line up with the footage
+        frame_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        sinks(frame, frame_record(index, frame_time, estimates), estimates)
+
+        # Exit on pressing 'q'
+        if sinks.stopped:
+            break
+
+    sinks.close()
+    cap.release()
+    cv2.destroyAllWindows()
 
-cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()
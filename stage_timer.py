@@ -0,0 +1,53 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# Per-stage latency recorder shared by the vision scripts and benchmark.py.
+#
+# Production code takes a `timer` argument that defaults to NULL_TIMER, so
+# timing costs nothing unless a benchmark passes a real StageTimer in.
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        summary = {}
+        for stage, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000.0
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[stage] = {
+                "count": int(len(ms)),
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(ms.max())
+            }
+        return summary
+
+
+class _NullTimer:
+    _context = nullcontext()
+
+    def __call__(self, stage):
+        return self._context
+
+    def record(self, stage, seconds):
+        pass
+
+
+NULL_TIMER = _NullTimer()
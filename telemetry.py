@@ -0,0 +1,131 @@
+import gzip
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# Headless telemetry.
+#
+# The analysis stages of the vision scripts describe each frame as one small
+# record (tracks, speeds, risk levels, lane lines) and hand it to a list of
+# sinks together with the script's own analysis objects (`detail`).
+# TelemetrySink streams the records as compact JSON lines (gzipped when the
+# path ends in .gz); DisplaySink draws, shows and/or records the annotated
+# frame from `detail` and is only attached when somebody is watching. On the
+# bike there is no screen, so no drawing work is done at all there.
+
+FLOAT_DIGITS = 2
+
+
+def compact(value, digits=FLOAT_DIGITS):
+    # Round floats and turn numpy scalars/arrays into plain JSON values
+    if isinstance(value, dict):
+        return {k: compact(v, digits) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [compact(v, digits) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return round(value, digits) if np.isfinite(value) else None
+    return value
+
+
+def make_record(index, frame_time, objects, lane=None, **extra):
+    # One frame: `objects` is a list of per-object dicts, `lane` an optional
+    # dict describing the lane; None fields are left out of the record
+    record = {"i": index, "t": None, "obj": objects}
+    if lane is not None:
+        record["lane"] = lane
+    record.update(extra)
+    record = compact(record)
+    # Timestamps keep millisecond resolution
+    record["t"] = round(float(frame_time), 3)
+    return record
+
+
+class TelemetrySink:
+    def __init__(self, path, flush_every=30):
+        # "-" streams to stdout, e.g. into a logger on the bike
+        self.path = path
+        self.flush_every = flush_every
+        self.records = 0
+        if path == "-":
+            self._file = sys.stdout
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            opener = gzip.open if path.endswith(".gz") else open
+            self._file = opener(path, "wt", encoding="utf-8")
+
+    def __call__(self, frame, record, detail=None):
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+        self.records += 1
+        if self.records % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
+class DisplaySink:
+    # `render(frame, detail)` returns the annotated frame. It is shown in
+    # `window` and/or written to `video_path`; pressing 'q' in the window
+    # sets `stopped`.
+    def __init__(self, render, window=None, video_path=None, fps=30):
+        self.render = render
+        self.window = window
+        self.video_path = video_path
+        self.fps = fps
+        self.stopped = False
+        self._writer = None
+
+    def __call__(self, frame, record, detail=None):
+        output = self.render(frame, detail)
+        if self.video_path:
+            if self._writer is None:
+                height, width = output.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                self._writer = cv2.VideoWriter(self.video_path, fourcc, self.fps, (width, height))
+            self._writer.write(output)
+        if self.window:
+            cv2.imshow(self.window, output)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.stopped = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+        if self.window:
+            cv2.destroyWindow(self.window)
+
+
+class Sinks:
+    # Fans every record out to the attached sinks
+    def __init__(self, sinks=()):
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    @property
+    def rendering(self):
+        return any(isinstance(sink, DisplaySink) for sink in self.sinks)
+
+    @property
+    def stopped(self):
+        return any(getattr(sink, "stopped", False) for sink in self.sinks)
+
+    def __call__(self, frame, record, detail=None):
+        for sink in self.sinks:
+            sink(frame, record, detail)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
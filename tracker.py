@@ -0,0 +1,157 @@
+import numpy as np
+from filterpy.kalman import KalmanFilter
+from scipy.optimize import linear_sum_assignment
+
+from geometry import iou_matrix
+
+# Multi-object tracker with stable IDs and bounded state.
+#
+# Each track carries a constant-velocity Kalman filter over the box centre,
+# area and aspect ratio (the SORT motion model). Detections are associated
+# to the predicted boxes with one vectorized IoU matrix and the Hungarian
+# algorithm. Tracks that go unmatched for `max_age` frames are dropped and
+# their IDs reported in `expired_ids`, so anything keyed by track ID can be
+# pruned and memory stays flat over an hour-long ride.
+
+
+def _bbox_to_z(bbox):
+    x1, y1, x2, y2 = bbox
+    w = max(x2 - x1, 1.0)
+    h = max(y2 - y1, 1.0)
+    return np.array([[x1 + w / 2.0], [y1 + h / 2.0], [w * h], [w / h]])
+
+
+def _x_to_bbox(x):
+    area = max(float(x[2, 0]), 1.0)
+    ratio = max(float(x[3, 0]), 1e-3)
+    w = np.sqrt(area * ratio)
+    h = area / w
+    cx, cy = float(x[0, 0]), float(x[1, 0])
+    return np.array([cx - w / 2.0, cy - h / 2.0, cx + w / 2.0, cy + h / 2.0])
+
+
+class KalmanBoxTrack:
+    def __init__(self, track_id, bbox, cls=-1):
+        self.id = track_id
+        self.cls = cls
+        self.hits = 1
+        self.hit_streak = 1
+        self.age = 0
+        self.time_since_update = 0
+
+        # State: cx, cy, area, ratio, vx, vy, varea
+        kf = KalmanFilter(dim_x=7, dim_z=4)
+        kf.F = np.array([
+            [1, 0, 0, 0, 1, 0, 0],
+            [0, 1, 0, 0, 0, 1, 0],
+            [0, 0, 1, 0, 0, 0, 1],
+            [0, 0, 0, 1, 0, 0, 0],
+            [0, 0, 0, 0, 1, 0, 0],
+            [0, 0, 0, 0, 0, 1, 0],
+            [0, 0, 0, 0, 0, 0, 1]
+        ], dtype=float)
+        kf.H = np.array([
+            [1, 0, 0, 0, 0, 0, 0],
+            [0, 1, 0, 0, 0, 0, 0],
+            [0, 0, 1, 0, 0, 0, 0],
+            [0, 0, 0, 1, 0, 0, 0]
+        ], dtype=float)
+        kf.R[2:, 2:] *= 10.0
+        kf.P[4:, 4:] *= 1000.0  # velocities start out unknown
+        kf.P *= 10.0
+        kf.Q[-1, -1] *= 0.01
+        kf.Q[4:, 4:] *= 0.01
+        kf.x[:4] = _bbox_to_z(bbox)
+        self.kf = kf
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+
+    def predict(self):
+        # Keep the predicted area positive
+        if self.kf.x[6, 0] + self.kf.x[2, 0] <= 0:
+            self.kf.x[6, 0] = 0.0
+        self.kf.predict()
+        self.age += 1
+        if self.time_since_update > 0:
+            self.hit_streak = 0
+        self.time_since_update += 1
+        self.bbox = _x_to_bbox(self.kf.x)
+        return self.bbox
+
+    def update(self, bbox):
+        self.kf.update(_bbox_to_z(bbox))
+        self.hits += 1
+        self.hit_streak += 1
+        self.time_since_update = 0
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+
+    @property
+    def velocity(self):
+        return float(self.kf.x[4, 0]), float(self.kf.x[5, 0])
+
+
+class MultiObjectTracker:
+    def __init__(self, max_age=15, min_hits=2, iou_threshold=0.3, match_classes=True):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.match_classes = match_classes
+        self.tracks = []
+        self.expired_ids = []
+        self.frame_count = 0
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _associate(self, boxes, classes, predicted):
+        if len(boxes) == 0 or len(predicted) == 0:
+            return np.empty((0, 2), dtype=np.int64)
+
+        iou = iou_matrix(boxes, predicted)
+        if self.match_classes and classes is not None:
+            track_classes = np.array([t.cls for t in self.tracks])
+            iou = np.where(classes[:, None] == track_classes[None, :], iou, 0.0)
+
+        det_idx, trk_idx = linear_sum_assignment(-iou)
+        keep = iou[det_idx, trk_idx] >= self.iou_threshold
+        return np.stack([det_idx[keep], trk_idx[keep]], axis=1)
+
+    def update(self, boxes, classes=None):
+        # Advance all tracks by one frame and associate `boxes` (N, 4 xyxy).
+        # Returns the track ID of every detection, in input order.
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if classes is not None:
+            classes = np.asarray(classes).reshape(-1)
+        self.frame_count += 1
+
+        predicted = np.array([t.predict() for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        matches = self._associate(boxes, classes, predicted)
+
+        track_ids = np.zeros(len(boxes), dtype=np.int64)
+        matched = np.zeros(len(boxes), dtype=bool)
+        for det, trk in matches:
+            track = self.tracks[trk]
+            track.update(boxes[det])
+            track_ids[det] = track.id
+            matched[det] = True
+
+        for det in np.flatnonzero(~matched):
+            cls = int(classes[det]) if classes is not None else -1
+            track = KalmanBoxTrack(self._next_id, boxes[det], cls)
+            self._next_id += 1
+            self.tracks.append(track)
+            track_ids[det] = track.id
+
+        # Expire stale tracks so per-ID state elsewhere can be released
+        self.expired_ids = [t.id for t in self.tracks if t.time_since_update > self.max_age]
+        if self.expired_ids:
+            self.tracks = [t for t in self.tracks if t.time_since_update <= self.max_age]
+
+        return track_ids
+
+    def confirmed_tracks(self):
+        return [
+            t for t in self.tracks
+            if t.time_since_update == 0
+            and (t.hits >= self.min_hits or self.frame_count <= self.min_hits)
+        ]
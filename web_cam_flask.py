@@ -1,22 +1,80 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, Response
 import cv2
 import threading
 import time
-import os
-from collections import deque
 import numpy as np
-from datetime import datetime
 import copy
+import os
+from blackbox import EncodedFrameBuffer, FrameEncoder
+from clip_export import ClipExporter
+from ring_file import MappedFrameRing, recover
+from live_stream import BOUNDARY, FrameBroadcaster, mjpeg_stream
 
 app = Flask(__name__)
 
+# Pre-event buffer: JPEG frames, encoded off the capture thread and bounded
+# by a byte budget (48 MB holds ~30 s of 640x480 at 30 fps) instead of raw
+# frames bounded by count
+BUFFER_BYTES = 48 * 1024 * 1024
+JPEG_QUALITY = 80
+
+# "memory" keeps the encoded frames in the process; "mmap" keeps them in a
+# fixed-size memory-mapped ring file that survives a crash of the process or
+# the board. A ring left by the previous run is recovered to a clip first.
+STORAGE_MODE = "memory"
+RING_PATH = "recordings/blackbox.ring"
+
+# Capture rate cap, and the clip window around an accident trigger: up to
+# PRE_EVENT_SECONDS before it (as far as the buffer reaches) and
+# POST_EVENT_SECONDS after it, so the impact itself is on the clip
+CAPTURE_FPS = 30
+PRE_EVENT_SECONDS = 30.0
+POST_EVENT_SECONDS = 10.0
+
+def recover_previous_ring():
+    # Move the last run's ring aside under a name of its own and write its
+    # frames to a clip in the background, before the new run starts
+    # overwriting them. The moved file is deleted once its clip is saved.
+    if not os.path.exists(RING_PATH):
+        return
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    previous = f"{RING_PATH}.{stamp}.prev"
+    count = 1
+    while os.path.exists(previous):
+        count += 1
+        previous = f"{RING_PATH}.{stamp}_{count}.prev"
+    os.replace(RING_PATH, previous)
+    def run():
+        try:
+            output = recover(previous, output_dir='recordings')
+            if output:
+                print(f"Recovered black-box clip saved to {output}")
+            os.remove(previous)
+        except Exception as e:
+            print(f"Could not recover {previous}: {e}")
+    threading.Thread(target=run, name="ring-recovery", daemon=True).start()
+
+def create_frame_buffer():
+    if STORAGE_MODE == "mmap":
+        recover_previous_ring()
+        return MappedFrameRing(RING_PATH, capacity=BUFFER_BYTES)
+    return EncodedFrameBuffer(BUFFER_BYTES)
+
 # Global variables
-frame_buffer = deque(maxlen=900)  # 30 seconds at 30 fps = 900 frames
-buffer_lock = threading.Lock()  # Add lock for thread safety
+# The frame buffer is created on the first /start rather than at import: the
+# debug reloader imports this module twice, and only the process serving
+# requests may move, recover and reopen the ring file
+frame_buffer = None  # has its own lock
+buffer_lock = threading.Lock()
+frame_encoder = None
+# Latest encoded frame for the /stream viewers; encoded once, shared by all
+broadcaster = FrameBroadcaster()
+# Accident clips are encoded by background workers, never in the request
+clip_exporter = ClipExporter(output_dir='recordings', workers=2)
 recording_flag = False
-accident_flag = False
 camera = None
 recording_thread = None
+capture_stats = {"frames": 0, "skipped": 0}
 
 def initialize_camera():
     global camera
@@ -31,52 +89,60 @@ def cleanup_camera():
         camera.release()
 
 def frame_capture():
-    global frame_buffer, camera, recording_flag
+    global camera, recording_flag
+    # camera.read() blocks until the next frame, so there is no sleep here;
+    # every frame is stamped with its capture time, and frames arriving
+    # faster than CAPTURE_FPS are skipped against a timestamp schedule
+    period = 1.0 / CAPTURE_FPS
+    next_due = 0.0
     while recording_flag:
-        if camera and camera.isOpened():
-            ret, frame = camera.read()
-            if ret:
-                with buffer_lock:
-                    frame_buffer.append(frame)
-            time.sleep(1/30)  # Approximate 30 FPS
-
-def save_accident_video():
-    global frame_buffer, accident_flag
-    
-    if not os.path.exists('recordings'):
-        os.makedirs('recordings')
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_path = f'recordings/accident_{timestamp}.mp4'
-    
-    # Create a copy of the buffer with the lock
+        if not (camera and camera.isOpened()):
+            time.sleep(0.01)
+            continue
+        ret, frame = camera.read()
+        timestamp = time.time()
+        if not ret:
+            time.sleep(0.005)  # Don't spin on a failing camera
+            continue
+        # A quarter period of jitter is accepted as on time
+        if timestamp < next_due - period / 4:
+            capture_stats["skipped"] += 1
+            continue
+        next_due = max(next_due + period, timestamp + period / 2)
+        capture_stats["frames"] += 1
+        frame_encoder.submit(frame, timestamp)
+
+def get_frame_buffer():
+    global frame_buffer
     with buffer_lock:
-        frames_to_save = list(frame_buffer)
-    
-    if frames_to_save:
-        # Get video properties from the first frame
-        height, width = frames_to_save[0].shape[:2]
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, 30.0, (width, height))
-        
-        # Write frames to video
-        for frame in frames_to_save:
-            out.write(frame)
-        
-        out.release()
-        print(f"Accident video saved to {output_path}")
-    
-    accident_flag = False
+        if frame_buffer is None:
+            frame_buffer = create_frame_buffer()
+        return frame_buffer
+
+def save_accident_video(post_seconds=POST_EVENT_SECONDS):
+    # Snapshot of the pre-event frames (the buffer keeps filling meanwhile;
+    # in mmap mode these are views into the ring), encoded right away; the
+    # frames of the next `post_seconds` are appended once they have been
+    # recorded. The clip is written at the measured frame rate. Returns the
+    # job ID.
+    trigger_time = time.time()
+    frames_to_save = frame_buffer.snapshot(since=trigger_time - PRE_EVENT_SECONDS)
+    if not frames_to_save:
+        raise Exception("No frames buffered yet")
+    return clip_exporter.submit(
+        frames_to_save, source=frame_buffer, until=trigger_time + max(0.0, post_seconds)
+    )
 
 @app.route('/start', methods=['POST'])
 def start_recording():
-    global recording_thread, recording_flag
+    global recording_thread, recording_flag, frame_encoder
     
     try:
         if not recording_flag:  # Prevent multiple recording threads
             initialize_camera()
+            if frame_encoder is None:
+                frame_encoder = FrameEncoder(get_frame_buffer(), quality=JPEG_QUALITY,
+                                             publish=broadcaster.publish)
             recording_flag = True
             recording_thread = threading.Thread(target=frame_capture)
             recording_thread.daemon = True
@@ -99,27 +165,59 @@ def stop_recording():
 
 @app.route('/accident', methods=['POST'])
 def report_accident():
-    global accident_flag
-    
     if not recording_flag:
         return jsonify({"error": "Recording is not active"}), 400
     
-    accident_flag = True
+    # Answers right away; poll /accident/<job_id> for the saved clip, which
+    # is exported once the post-event window ("post_seconds") has passed
     try:
-        save_accident_video()
-        return jsonify({"message": "Accident video saved successfully"}), 200
+        options = request.get_json(silent=True) or {}
+        post_seconds = float(options.get("post_seconds", POST_EVENT_SECONDS))
+        job_id = save_accident_video(post_seconds)
+        return jsonify({
+            "message": "Accident video export started",
+            "job_id": job_id,
+            "post_event_seconds": post_seconds,
+            "status_url": f"/accident/{job_id}"
+        }), 202
     except Exception as e:
-        accident_flag = False
         return jsonify({"error": str(e)}), 500
 
+@app.route('/accident/<job_id>', methods=['GET'])
+def accident_status(job_id):
+    job = clip_exporter.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job), 200
+
+@app.route('/accidents', methods=['GET'])
+def list_accidents():
+    return jsonify({"jobs": clip_exporter.jobs()}), 200
+
+@app.route('/stream', methods=['GET'])
+def live_stream():
+    # MJPEG live view (usable as an <img> source); "fps" caps the rate
+    # for this client
+    if not recording_flag:
+        return jsonify({"error": "Recording is not active"}), 400
+    max_fps = request.args.get("fps", type=float)
+    return Response(
+        mjpeg_stream(broadcaster, max_fps=max_fps),
+        mimetype=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.route('/status', methods=['GET'])
 def get_status():
-    with buffer_lock:
-        buffer_size = len(frame_buffer)
+    buffer_stats = frame_buffer.stats() if frame_buffer is not None else {"frames": 0}
     return jsonify({
         "recording": recording_flag,
-        "buffer_size": buffer_size,
-        "accident_mode": accident_flag
+        "buffer_size": buffer_stats["frames"],
+        "accident_mode": clip_exporter.active() > 0,
+        "buffer": buffer_stats,
+        "capture": dict(capture_stats, target_fps=CAPTURE_FPS),
+        "encoder": frame_encoder.stats() if frame_encoder else None,
+        "stream": broadcaster.stats()
     }), 200
 
 if __name__ == '__main__':